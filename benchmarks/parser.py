@@ -0,0 +1,299 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare the `xrandr --verbose` parser against the line splitting parser it replaced.
+
+Run as `python -m benchmarks.parser [dump ...]` from the source directory; by
+default, the dumps in benchmarks/data are used. Those are synthetic (made up
+after a laptop and a multi-head workstation, like the ones generated by
+benchmarks.synthetic), not captured from real machines. Only the parsing is
+timed, not the copy load_from_x keeps for reusing the state. Speedups below
+TARGET are marked in the output."""
+
+import os
+import sys
+import glob
+import timeit
+import warnings
+
+from screenlayout.xrandr import XRandR, Feature
+
+DATADIR = os.path.join(os.path.dirname(__file__), 'data')
+
+# the speedup over the legacy parser that the single-pass parser is meant to reach
+TARGET = 5
+
+class DumpXRandR(XRandR):
+    """XRandR that reads an `xrandr --verbose` dump instead of running xrandr"""
+    def __init__(self, dump):
+        self.dump = dump
+        XRandR.__init__(self, backend='xrandr')
+
+    def _output(self, *args):
+        if args == ('--version',):
+            return "xrandr program version       1.5.0\nServer reports RandR version 1.5\n"
+        assert args == ('--verbose',)
+        return self.dump
+
+    def parse(self):
+        """Parse the dump into a new State and Configuration like
+        load_from_x, but without keeping a copy for reuse"""
+        self.configuration = self.Configuration(self)
+        self.state = self.State()
+        self._load_from_verbose(self.dump, self.state, self.configuration)
+
+#################### arandr 0.1.9 ####################
+
+# The parser is compared against the one it replaced together with the
+# classes that one built, as they were back then, so that later changes to
+# the current classes don't shift the baseline.
+
+class LegacySize(tuple):
+    def __new__(cls, arg):
+        if isinstance(arg, basestring):
+            arg = [int(x) for x in arg.split("x")]
+        arg = tuple(arg)
+        assert len(arg)==2
+        return super(LegacySize, cls).__new__(cls, arg)
+
+class LegacyNamedSize(object):
+    def __init__(self, size, name):
+        self._size = size
+        self.name = name
+
+    def __iter__(self):
+        return self._size.__iter__()
+
+    def __getitem__(self, i):
+        return self._size[i]
+
+    def __len__(self):
+        return 2
+
+class LegacyPosition(tuple):
+    def __new__(cls, arg):
+        if isinstance(arg, basestring):
+            arg = [int(x) for x in arg.split("x")]
+        arg = tuple(arg)
+        assert len(arg)==2
+        return super(LegacyPosition, cls).__new__(cls, arg)
+
+class LegacyGeometry(tuple):
+    def __new__(cls, width, height=None, left=None, top=None):
+        if isinstance(width, basestring):
+            width,rest = width.split("x")
+            height,left,top = rest.split("+")
+        return super(LegacyGeometry, cls).__new__(cls, (int(width), int(height), int(left), int(top)))
+
+    position = property(lambda self:LegacyPosition(self[2:4]))
+    size = property(lambda self:LegacySize(self[0:2]))
+
+class LegacyRotation(str):
+    def __init__(self, original_me):
+        if self not in ('left','right','normal','inverted'):
+            raise Exception("No know rotation.")
+    is_odd = property(lambda self: self in ('left','right'))
+
+LEGACY_NORMAL = LegacyRotation('normal')
+LEGACY_ROTATIONS = (LEGACY_NORMAL, LegacyRotation('right'), LegacyRotation('inverted'), LegacyRotation('left'))
+
+class LegacyXRandR(DumpXRandR):
+    """The parser as it was before the single-pass tokenizer (arandr 0.1.9)"""
+    class State(object):
+        def __init__(self):
+            self.outputs = {}
+
+        class Virtual(object):
+            def __init__(self, min, max):
+                self.min = min
+                self.max = max
+
+        class Output(object):
+            def __init__(self, name):
+                self.name = name
+                self.modes = []
+
+    class Configuration(object):
+        def __init__(self, xrandr):
+            self.outputs = {}
+            self._xrandr = xrandr
+
+        class OutputConfiguration(object):
+            def __init__(self, active, primary, geometry, rotation, modename):
+                self.active = active
+                self.primary = primary
+                if active:
+                    self.position = geometry.position
+                    self.rotation = rotation
+                    if rotation.is_odd:
+                        self.mode = LegacyNamedSize(LegacySize(reversed(geometry.size)), name=modename)
+                    else:
+                        self.mode = LegacyNamedSize(geometry.size, name=modename)
+
+    def load_from_x(self):
+        self.configuration = self.Configuration(self)
+        self.state = self.State()
+
+        screenline, items = self._load_raw_lines()
+
+        self._load_parse_screenline(screenline)
+
+        for headline,details in items:
+            if headline.startswith("  "): continue # a currently disconnected part of the screen i can't currently get any info out of
+            if headline == "": continue # noise
+
+            headline = headline.replace('unknown connection', 'unknown-connection')
+            hsplit = headline.split(" ")
+            o = self.state.Output(hsplit[0])
+            assert hsplit[1] in ("connected","disconnected", 'unknown-connection')
+
+            o.connected = (hsplit[1] in ('connected', 'unknown-connection'))
+
+            primary = False
+            if 'primary' in hsplit:
+                if Feature.PRIMARY in self.features:
+                    primary = True
+                hsplit.remove('primary')
+
+            if not hsplit[2].startswith("("):
+                active = True
+
+                geometry = LegacyGeometry(hsplit[2])
+
+                modeid = hsplit[3].strip("()")
+
+                if hsplit[4] in LEGACY_ROTATIONS: rotation = LegacyRotation(hsplit[4])
+                else: rotation = LEGACY_NORMAL
+            else:
+                active = False
+                geometry = None
+                modeid = None
+                rotation = None
+
+            o.rotations = set()
+            for r in LEGACY_ROTATIONS:
+                if r in headline:
+                    o.rotations.add(r)
+
+            currentname = None
+            for d, w, h in details:
+                n, m = d[0:2]
+                k = m.strip("()")
+                try:
+                    r = LegacySize([int(w), int(h)])
+                except ValueError:
+                    raise Exception("Output %s parse error: modename %s modeid %s."%(o.name, n,k))
+                if "*current" in d:
+                    currentname = n
+                for x in [ "+preferred", "*current" ]:
+                    if x in d: d.remove(x)
+
+                for old_mode in o.modes:
+                    if old_mode.name == n:
+                        if tuple(old_mode) != tuple(r):
+                            warnings.warn("Supressing duplicate mode %s even though it has different resolutions (%s, %s)."%(n, r, old_mode))
+                        break
+                else:
+                    # the mode is really new
+                    o.modes.append(LegacyNamedSize(r, name=n))
+
+            self.state.outputs[o.name] = o
+            self.configuration.outputs[o.name] = self.configuration.OutputConfiguration(active, primary, geometry, rotation, currentname)
+
+    parse = load_from_x
+
+    def _load_raw_lines(self):
+        output = self._output("--verbose")
+        items = []
+        screenline = None
+        for l in output.split('\n'):
+            if l.startswith("Screen "):
+                assert screenline is None
+                screenline = l
+            elif l.startswith('\t'):
+                continue
+            elif l.startswith(2*' '): # [mode, width, height]
+                l = l.strip()
+                if reduce(bool.__or__, [l.startswith(x+':') for x in "hv"]):
+                    l = l[-len(l):l.index(" start")-len(l)]
+                    items[-1][1][-1].append(l[l.rindex(' '):])
+                else: # mode
+                    items[-1][1].append([l.split()])
+            else:
+                items.append([l, []])
+        return screenline, items
+
+    def _load_parse_screenline(self, screenline):
+        assert screenline is not None
+        ssplit = screenline.split(" ")
+
+        ssplit_expect = ["Screen",None,"minimum",None,"x",None,"current",None,"x",None,"maximum",None,"x",None]
+        assert all(a==b for (a,b) in zip(ssplit,ssplit_expect) if b is not None)
+
+        self.state.virtual = self.state.Virtual(
+                min = LegacySize((int(ssplit[3]),int(ssplit[5][:-1]))),
+                max = LegacySize((int(ssplit[11]),int(ssplit[13])))
+                )
+        self.configuration.virtual = LegacySize((int(ssplit[7]),int(ssplit[9][:-1])))
+
+def describe(xrandr):
+    """Everything load_from_x found out, in a form that can be compared"""
+    state = dict((on, (o.connected, sorted(o.rotations), [(m.name, tuple(m)) for m in o.modes])) for (on, o) in xrandr.state.outputs.items())
+    configuration = dict((on, (o.active, o.primary) + ((tuple(o.position), o.rotation, o.mode.name, tuple(o.mode)) if o.active else ())) for (on, o) in xrandr.configuration.outputs.items())
+    return (tuple(xrandr.state.virtual.min), tuple(xrandr.state.virtual.max), tuple(xrandr.configuration.virtual), state, configuration)
+
+def best_of(xrandr, repeat=15, number=None):
+    """Seconds per load_from_x call"""
+    timer = timeit.Timer(xrandr.load_from_x)
+    if number is None:
+        number = max(1, int(0.05 / min(timer.repeat(3, 1))))
+    return min(timer.repeat(repeat, number)) / number
+
+def compare(new, old, rounds=25):
+    """Seconds per parse call of `new` and `old`, each the best of
+    `rounds` runs that alternate between the two, so that varying load on
+    the machine affects both alike"""
+    timers = [timeit.Timer(x.parse) for x in (new, old)]
+    numbers = [max(1, int(0.05 / min(t.repeat(3, 1)))) for t in timers]
+    best = [float('inf')] * 2
+    for i in range(rounds):
+        for j in range(2):
+            best[j] = min(best[j], timers[j].timeit(numbers[j]) / numbers[j])
+    return best
+
+def main():
+    dumps = sys.argv[1:] or sorted(glob.glob(os.path.join(DATADIR, '*-verbose.txt')))
+
+    for filename in dumps:
+        dump = open(filename).read()
+        new = DumpXRandR(dump)
+        old = LegacyXRandR(dump)
+
+        warnings.simplefilter('ignore')
+        new.load_from_x()
+        old.load_from_x()
+        assert describe(new) == describe(old), "Parsers disagree on %s"%filename
+
+        t_new, t_old = compare(new, old)
+        print "%-36s %4d outputs %5d modes  legacy %8.3fms  single-pass %8.3fms  speedup %5.1fx%s"%(
+                os.path.basename(filename),
+                len(new.state.outputs),
+                sum(len(o.modes) for o in new.state.outputs.values()),
+                t_old*1000, t_new*1000, t_old/t_new,
+                "" if t_old/t_new >= TARGET else "  (below the %dx target)"%TARGET)
+
+if __name__ == "__main__":
+    main()
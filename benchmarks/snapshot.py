@@ -0,0 +1,64 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Round trip snapshots of synthetic machines.
+
+Run as `python -m benchmarks.snapshot [outputs ...]` from the source directory;
+besides the dumps in benchmarks/data, machines with 64 and 256
+outputs are generated by default (see benchmarks.synthetic). For comparison,
+the time it takes to parse the corresponding `xrandr --verbose` output is
+shown."""
+
+import os
+import sys
+import glob
+import timeit
+import warnings
+
+from screenlayout import snapshot
+
+from .parser import DATADIR, DumpXRandR, describe, best_of
+from .synthetic import verbose_dump
+
+def measure(name, xrandr, parse=None):
+    data = snapshot.dumps(xrandr)
+    assert describe(snapshot.loads(data)) == describe(xrandr), "Round trip changes %s"%name
+
+    t_dump = min(timeit.repeat(lambda: snapshot.dumps(xrandr), repeat=5, number=5)) / 5
+    t_load = min(timeit.repeat(lambda: snapshot.loads(data), repeat=5, number=5)) / 5
+    print "%-32s %4d outputs %6d modes %8d bytes  dump %8.3fms  load %8.3fms%s"%(
+            name,
+            len(xrandr.state.outputs),
+            sum(len(o.modes) for o in xrandr.state.outputs.values()),
+            len(data),
+            t_dump*1000, t_load*1000,
+            "  (--verbose parse %8.3fms)"%(parse*1000) if parse is not None else "")
+
+def main():
+    warnings.simplefilter('ignore')
+
+    sizes = [int(a) for a in sys.argv[1:]] or [64, 256]
+
+    dumps = [(os.path.basename(f), open(f).read()) for f in sorted(glob.glob(os.path.join(DATADIR, '*-verbose.txt')))]
+    dumps += [("synthetic", verbose_dump(n)) for n in sizes]
+
+    for name, dump in dumps:
+        x = DumpXRandR(dump)
+        x.load_from_x()
+        measure(name, x, best_of(x, repeat=5))
+
+if __name__ == "__main__":
+    main()
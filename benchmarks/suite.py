@@ -0,0 +1,262 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark suite for the screenlayout core on synthetic machines.
+
+Run as `python -m benchmarks.suite [-o results.json] [-s 2,16] [benchmark ...]`
+from the source directory. Every benchmark runs on machines with 2, 16, 64 and
+256 outputs (see benchmarks.synthetic), each in a fresh interpreter, so that
+the peak memory (maximum resident set size, in kilobytes) that is reported
+next to the time per call belongs to that benchmark alone. The `baseline` is
+what the interpreter used after importing everything, before the benchmark's
+data was set up.
+
+With -o, the results are written as JSON for comparison between releases.
+Benchmarks whose dependencies are missing (drawing needs PyGTK) are reported
+as skipped. With NumPy, check_configurations first makes sure that its
+vectorized checks give the same verdicts as checking one after the other."""
+
+from __future__ import division
+import sys
+import json
+import time
+import timeit
+import platform
+import optparse
+import resource
+import subprocess
+import warnings
+
+from screenlayout.auxiliary import Position
+from screenlayout.snap import Snap
+from screenlayout import validation
+from screenlayout.validation import check_configurations
+from screenlayout.meta import __version__
+
+from .parser import DumpXRandR
+from .synthetic import verbose_dump, rearranged
+
+SIZES = [2, 16, 64, 256]
+
+class Skipped(Exception):
+    """A benchmark can't run in this environment."""
+
+def timed(function, repeat=5):
+    """Seconds per call of function, as the best of `repeat` runs that take
+    about 50ms each"""
+    timer = timeit.Timer(function)
+    number = max(1, int(0.05 / max(min(timer.repeat(3, 1)), 1e-6)))
+    return min(timer.repeat(repeat, number)) / number
+
+#################### benchmarks ####################
+
+# Each benchmark takes the number of outputs, sets up what it needs, and
+# returns the function to be timed.
+
+def _loaded(outputs):
+    x = DumpXRandR(verbose_dump(outputs))
+    x.load_from_x()
+    return x
+
+def bench_load_from_x(outputs):
+    """parse `xrandr --verbose` output"""
+    return _loaded(outputs).load_from_x
+
+def bench_load_from_string(outputs):
+    """load a layout script on top of a loaded state"""
+    x = _loaded(outputs)
+    script = rearranged(x)
+    return lambda: x.load_from_string(script, reuse=True)
+
+def bench_commandlineargs(outputs):
+    """build the xrandr arguments for a configuration"""
+    x = _loaded(outputs)
+    x.load_from_string(rearranged(x), reuse=True)
+    return x.configuration.commandlineargs
+
+def bench_check_configuration(outputs):
+    """validate a configuration"""
+    x = _loaded(outputs)
+    x.load_from_string(rearranged(x), reuse=True)
+    return x.check_configuration
+
+def bench_check_configurations(outputs):
+    """validate 100 candidate configurations at once"""
+    x = _loaded(outputs)
+    valid = x.configuration.copy()
+    x.load_from_string(rearranged(x), reuse=True)
+    candidates = []
+    for i in range(100):
+        c = x.configuration.copy()
+        for o in c.outputs.values():
+            if o.active:
+                o.position = Position((o.position[0] + i, o.position[1]))
+        candidates.append(c)
+    _check_verdicts(x, candidates + [valid])
+    return lambda: check_configurations(x, candidates)
+
+def _check_verdicts(x, candidates):
+    """Make sure the vectorized checks agree with the ones done one after
+    the other, also on overlapping and out-of-bounds candidates"""
+    if validation.numpy is None:
+        return
+    vmax = x.state.virtual.max
+    moves = [
+            lambda o, i: Position((0, 0)), # all on top of each other
+            lambda o, i: Position((vmax[0] - o.size[0] + 1, o.position[1])), # partly outside
+            lambda o, i: Position((-1 - i, o.position[1])), # outside
+            lambda o, i: Position((o.position[0] - o.size[0] // 2, o.position[1])) if i % 2 else o.position, # some overlap
+            ]
+    candidates = list(candidates)
+    for move in moves:
+        c = x.configuration.copy()
+        for i, on in enumerate(sorted(c.outputs)):
+            o = c.outputs[on]
+            if o.active:
+                o.position = move(o, i)
+        candidates.append(c)
+
+    packed = validation._pack(x, candidates)
+    for allow_overlap in (False, True):
+        vectorized = validation._verdicts_numpy(packed, vmax, allow_overlap)
+        single = [validation._verdict(rects, vmax, allow_overlap) for rects in packed]
+        assert [v and v.args for v in vectorized] == [v and v.args for v in single], "NumPy and pure Python validation disagree"
+
+def _snap_arguments(x):
+    cfg = x.configuration
+    dragged = sorted(on for on in cfg.outputs if cfg.outputs[on].active)[0]
+    others = [(Position((0, 0)), x.state.virtual.max, False)] + [(o.position, o.size) for (on, o) in cfg.outputs.items() if on != dragged and o.active]
+    return cfg.outputs[dragged].size, 40, others
+
+def bench_snap(outputs):
+    """set up snapping when a drag starts"""
+    args = _snap_arguments(_loaded(outputs))
+    return lambda: Snap(*args)
+
+def bench_snap_suggest(outputs):
+    """snap 100 positions along a drag across the screen"""
+    x = _loaded(outputs)
+    snap = Snap(*_snap_arguments(x))
+    vmax = x.configuration.virtual
+    positions = [Position((vmax[0] * i // 100 + 7, vmax[1] * i // 100 + 3)) for i in range(100)]
+    def suggest():
+        for p in positions:
+            snap.suggest(p)
+    return suggest
+
+def bench_draw(outputs):
+    """paint the widget at zoom 1:8 into an image surface"""
+    try:
+        import cairo
+        import pangocairo
+        from screenlayout.widget import ARandRWidget
+    except ImportError, e:
+        raise Skipped(str(e))
+
+    x = _loaded(outputs)
+
+    class Widget(object):
+        """Stand-in with what ARandRWidget._draw uses, so no display is needed"""
+        sequence = sorted(x.outputs)
+        factor = 8
+        _layouts = {}
+        _overlapping = set()
+        _guides = []
+        _text_layout = ARandRWidget._text_layout.im_func
+        _draw_background = ARandRWidget._draw_background.im_func
+        _draw_outputs = ARandRWidget._draw_outputs.im_func
+        _draw_guides = ARandRWidget._draw_guides.im_func
+    widget = Widget()
+    factor = widget.factor
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, x.state.virtual.max[0] // factor, x.state.virtual.max[1] // factor)
+    def draw():
+        cr = pangocairo.CairoContext(cairo.Context(surface))
+        cr.scale(1 / factor, 1 / factor)
+        cr.set_line_width(factor * 1.5)
+        ARandRWidget._draw.im_func(widget, x, cr)
+    return draw
+
+BENCHMARKS = [
+        ('load_from_x', bench_load_from_x),
+        ('load_from_string', bench_load_from_string),
+        ('commandlineargs', bench_commandlineargs),
+        ('check_configuration', bench_check_configuration),
+        ('check_configurations', bench_check_configurations),
+        ('snap', bench_snap),
+        ('snap_suggest', bench_snap_suggest),
+        ('draw', bench_draw),
+        ]
+
+#################### running ####################
+
+def run_single(name, outputs):
+    """Run one benchmark in this process and return its result dictionary"""
+    warnings.simplefilter('ignore')
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        function = dict(BENCHMARKS)[name](outputs)
+        seconds = timed(function)
+    except Skipped, e:
+        return {'benchmark': name, 'outputs': outputs, 'skipped': str(e)}
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'benchmark': name, 'outputs': outputs, 'seconds': seconds, 'peak_kb': peak, 'baseline_kb': baseline}
+
+def run_isolated(name, outputs):
+    """Run one benchmark in a fresh interpreter"""
+    p = subprocess.Popen([sys.executable, '-m', 'benchmarks.suite', '--single', name, str(outputs)], stdout=subprocess.PIPE)
+    out, _ = p.communicate()
+    if p.wait() != 0:
+        return {'benchmark': name, 'outputs': outputs, 'failed': p.returncode}
+    return json.loads(out)
+
+def main():
+    p = optparse.OptionParser(usage="%prog [options] [benchmark ...]", description="Benchmarks: " + ", ".join(n for (n, f) in BENCHMARKS))
+    p.add_option('-o', '--output', help='Write the results as JSON to FILE', metavar='FILE')
+    p.add_option('-s', '--sizes', help='Comma separated numbers of outputs (default: %default)', default=",".join(str(s) for s in SIZES))
+    p.add_option('--single', help=optparse.SUPPRESS_HELP, action='store_true')
+    (options, args) = p.parse_args()
+
+    if options.single:
+        print json.dumps(run_single(args[0], int(args[1])))
+        return
+
+    names = args or [n for (n, f) in BENCHMARKS]
+    for n in names:
+        if n not in dict(BENCHMARKS):
+            p.error("Unknown benchmark: %s"%n)
+    sizes = [int(s) for s in options.sizes.split(",")]
+
+    results = []
+    for name in names:
+        for outputs in sizes:
+            r = run_isolated(name, outputs)
+            results.append(r)
+            if 'seconds' in r:
+                print "%-20s %4d outputs %12.3fms %9dkB peak (%dkB baseline)"%(name, outputs, r['seconds']*1000, r['peak_kb'], r['baseline_kb'])
+            else:
+                print "%-20s %4d outputs %s"%(name, outputs, "skipped: %s"%r['skipped'] if 'skipped' in r else "failed")
+
+    if options.output:
+        json.dump({
+            'arandr': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'results': results,
+            }, open(options.output, 'w'), indent=1, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
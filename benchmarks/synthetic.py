@@ -0,0 +1,142 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Generators for `xrandr --verbose` output and layout scripts of machines of any size.
+
+The output is deterministic and resembles what real drivers print (including
+properties, EDID blocks and modes that only differ in their refresh rate), so
+it exercises the same code paths as real dumps would."""
+
+import random
+
+from screenlayout.auxiliary import NORMAL
+
+# (width, height, name) as reported by common monitors, largest first
+MODES = [
+        (1920, 1080, '1920x1080'), (3840, 2160, '3840x2160'), (4096, 2160, '4096x2160'),
+        (3200, 1800, '3200x1800'), (2880, 1620, '2880x1620'), (2560, 1600, '2560x1600'),
+        (2560, 1440, '2560x1440'), (2048, 1536, '2048x1536'), (2048, 1152, '2048x1152'),
+        (1920, 1440, '1920x1440'), (1920, 1200, '1920x1200'), (1920, 1080, '1920x1080i'),
+        (1856, 1392, '1856x1392'), (1792, 1344, '1792x1344'), (1680, 1050, '1680x1050'),
+        (1600, 1200, '1600x1200'), (1600, 1024, '1600x1024'), (1600, 900, '1600x900'),
+        (1440, 1080, '1440x1080'), (1440, 900, '1440x900'), (1400, 1050, '1400x1050'),
+        (1368, 768, '1368x768'), (1366, 768, '1366x768'), (1360, 768, '1360x768'),
+        (1280, 1024, '1280x1024'), (1280, 960, '1280x960'), (1280, 800, '1280x800'),
+        (1280, 720, '1280x720'), (1152, 864, '1152x864'), (1024, 768, '1024x768'),
+        (960, 720, '960x720'), (928, 696, '928x696'), (896, 672, '896x672'),
+        (864, 486, '864x486'), (840, 525, '840x525'), (832, 624, '832x624'),
+        (800, 600, '800x600'), (720, 576, '720x576'), (720, 480, '720x480'),
+        (720, 405, '720x405'), (700, 525, '700x525'), (640, 512, '640x512'),
+        (640, 480, '640x480'), (640, 400, '640x400'), (640, 360, '640x360'),
+        (576, 432, '576x432'), (512, 384, '512x384'), (400, 300, '400x300'),
+        (320, 240, '320x240'),
+        ]
+RATES = [60.0, 59.94, 50.0, 75.0, 72.0, 30.0, 25.0, 24.0, 23.98]
+
+# active outputs are placed in a grid of cells of the size of their first mode
+COLUMNS = 16
+CELL = MODES[0][:2]
+MAXIMUM = 32767
+
+def _modelines(count, current, seed):
+    lines = []
+    for i in range(count):
+        w, h, name = MODES[i % len(MODES)]
+        rate = RATES[(i // len(MODES)) % len(RATES)]
+        flags = ''
+        if i == current:
+            flags += ' *current'
+        if i == 0:
+            flags += ' +preferred'
+        clock = w * h * rate * 1.2 / 1e6
+        lines.append('  %s (0x%x) %.3fMHz +HSync -VSync%s\n'
+                '        h: width  %d start %d end %d total %d skew    0 clock  %.2fKHz\n'
+                '        v: height %d start %d end %d total %d           clock  %.2fHz\n'%(
+                    name, 0x40 + seed*0x100 + i, clock, flags,
+                    w, w+48, w+80, w+160, clock*1000/(w+160),
+                    h, h+3, h+8, h+30, rate))
+    return ''.join(lines)
+
+def _output(name, index, connected, active, position, modes, primary, rotation):
+    r = random.Random(index)
+    if active:
+        s = '%s connected%s %dx%d+%d+%d (0x%x) %s (normal left inverted right x axis y axis) 597mm x 336mm\n'%(
+                name, ' primary' if primary else '', CELL[0], CELL[1], position[0], position[1], 0x40 + index*0x100, rotation)
+    else:
+        s = '%s %s (normal left inverted right x axis y axis)\n'%(name, 'connected' if connected else 'disconnected')
+    s += '\tIdentifier: 0x%x\n\tTimestamp:  1234567\n\tSubpixel:   unknown\n'%(0x40 + index)
+    if active:
+        s += '\tGamma:      1.0:1.0:1.0\n\tBrightness: 1.0\n'
+    s += '\tClones:    \n'
+    if active:
+        s += '\tCRTC:       %d\n'%index
+    s += ('\tCRTCs:      0 1 2 3\n'
+            '\tTransform:  1.000000 0.000000 0.000000\n'
+            '\t            0.000000 1.000000 0.000000\n'
+            '\t            0.000000 0.000000 1.000000\n'
+            '\t           filter: \n')
+    if connected:
+        s += '\tEDID: \n' + ''.join('\t\t%032x\n'%r.getrandbits(128) for i in range(16))
+    s += ('\tBroadcast RGB: Automatic \n\t\tsupported: Automatic, Full, Limited 16:235\n'
+            '\taudio: auto \n\t\tsupported: force-dvi, off, auto, on\n'
+            '\tlink-status: Good \n\t\tsupported: Good, Bad\n'
+            '\tnon-desktop: 0 \n\t\trange: (0, 1)\n')
+    if connected:
+        s += _modelines(modes, 0 if active else -1, index)
+    return s
+
+def verbose_dump(outputs, modes=60):
+    """`xrandr --verbose` output for a machine with that many outputs, each
+    connected one supporting `modes` modes. Of every four outputs, one is
+    disconnected and one is connected but switched off."""
+    active = [i for i in range(outputs) if i % 4 in (0, 1)] if outputs > 2 else range(outputs)
+    cells = dict((i, n) for (n, i) in enumerate(active))
+    rows = (len(active) + COLUMNS - 1) // COLUMNS
+    current = (CELL[0] * min(len(active), COLUMNS), CELL[1] * rows) if active else (320, 200)
+
+    s = 'Screen 0: minimum 320 x 200, current %d x %d, maximum %d x %d\n'%(current + (MAXIMUM, MAXIMUM))
+    for i in range(outputs):
+        cell = cells.get(i)
+        position = (CELL[0] * (cell % COLUMNS), CELL[1] * (cell // COLUMNS)) if cell is not None else None
+        s += _output('DP-%d'%i, i,
+                connected = outputs <= 2 or i % 4 != 3,
+                active = cell is not None,
+                position = position,
+                modes = modes,
+                primary = i == 0,
+                rotation = 'inverted' if i % 8 == 5 else 'normal')
+    return s
+
+def rearranged(xrandr):
+    """Layout script for a loaded XRandR that reverses the order of the active
+    outputs, switches every third of them to the next smaller mode and
+    enables the outputs that were connected but off"""
+    cfg = xrandr.configuration.copy()
+    active = sorted((on for on in cfg.outputs if cfg.outputs[on].active), key=lambda on: int(on.split('-')[1]))
+    positions = [cfg.outputs[on].position for on in active]
+    for n, (on, position) in enumerate(zip(active, reversed(positions))):
+        o = cfg.outputs[on]
+        o.position = position
+        if n % 3 == 2:
+            o.mode = xrandr.state.outputs[on].get_largest_mode((CELL[0] - 1, CELL[1] - 1))
+    for on, o in cfg.outputs.items():
+        if not o.active and xrandr.state.outputs[on].connected and len(active) > 0:
+            o.active = True
+            o.primary = False
+            o.mode = xrandr.state.outputs[on].modes[-1]
+            o.position = positions[0]
+            o.rotation = NORMAL
+    return "#!/bin/sh\nxrandr %s\n"%" ".join(cfg.commandlineargs())
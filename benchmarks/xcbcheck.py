@@ -0,0 +1,374 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check the xcb backend against a scripted stand-in for python-xcb.
+
+Run as `python -m benchmarks.xcbcheck` from the source directory; python-xcb
+and an X server are not needed (an installed python-xcb is not used). Each
+scenario sets up a fake server, loads from it and applies a configuration
+with XRandR(backend='xcb'), and compares the requests that were sent with
+what a real server needs to get. This does not replace trying the backend
+on an X server (eg. Xvfb), as the stand-in only knows what the backend is
+expected to send."""
+
+import sys
+import types
+
+if 'screenlayout.xrandr' in sys.modules:
+    raise ImportError("benchmarks.xcbcheck has to be imported before screenlayout.xrandr.")
+
+#################### the stand-in ####################
+
+class FakeError(Exception):
+    pass
+
+class Reply(object):
+    """A request's cookie, which is also its reply"""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def reply(self):
+        return self
+
+    def check(self):
+        pass
+
+class ScreenChangeNotifyEvent(object):
+    pass
+
+class NotifyEvent(object):
+    pass
+
+class FakeServer(object):
+    """What an X server with RandR 1.3 knows about its outputs. `modes`
+    are (id, width, height, name) tuples; `crtcs` map ids to dictionaries
+    with x, y, mode, rotation, outputs and scale (as set by xrandr --scale,
+    which SetCrtcConfig keeps); `outputs` map ids to dictionaries with name,
+    crtc, crtcs and modes. Requests that change something are appended to
+    `requests`; SetCrtcConfig fails for the crtcs in `failing`."""
+    ROOT = 0x100
+
+    def __init__(self, modes, crtcs, outputs, primary=0, size=None, failing=()):
+        self.modes = modes
+        self.crtcs = crtcs
+        self.outputs = outputs
+        self.primary = primary
+        self.size = size
+        self.failing = set(failing)
+        self.requests = []
+        self.events = []
+
+        for c in self.crtcs.values():
+            c.setdefault('rotation', 1)
+            c.setdefault('outputs', [])
+            c.setdefault('scale', 1)
+        for o in self.outputs.values():
+            o.setdefault('connection', 0)
+        if self.size is None:
+            self.size = (max([0] + [c['x'] + self._crtc_size(c)[0] for c in self.crtcs.values() if c['mode']]),
+                    max([0] + [c['y'] + self._crtc_size(c)[1] for c in self.crtcs.values() if c['mode']]))
+
+    def _crtc_size(self, c):
+        if not c['mode']:
+            return (0, 0)
+        w, h = [(int(w * c['scale']), int(h * c['scale'])) for (mid, w, h, n) in self.modes if mid == c['mode']][0]
+        return (h, w) if c['rotation'] & 0xa else (w, h)
+
+    #################### xcb.Connection ####################
+
+    pref_screen = 0
+
+    def __call__(self, key):
+        assert key == 'randr'
+        return self
+
+    core = property(lambda self: self)
+
+    def get_setup(self):
+        return Reply(roots=[Reply(root=self.ROOT, width_in_pixels=self.size[0], height_in_pixels=self.size[1], width_in_millimeters=self.size[0] * 254 // 960, height_in_millimeters=self.size[1] * 254 // 960)])
+
+    def flush(self):
+        pass
+
+    def poll_for_event(self):
+        return self.events.pop(0) if self.events else None
+
+    def GetInputFocus(self):
+        return Reply()
+
+    def GetGeometry(self, window):
+        return Reply(width=self.size[0], height=self.size[1])
+
+    def GrabServer(self):
+        pass
+
+    def UngrabServer(self):
+        pass
+
+    #################### xcb.randr ####################
+
+    def QueryVersion(self, major, minor):
+        return Reply(major_version=1, minor_version=3)
+
+    def SelectInput(self, window, mask):
+        pass
+
+    def GetScreenResources(self, window):
+        return Reply(
+                config_timestamp=1,
+                crtcs=sorted(self.crtcs),
+                outputs=sorted(self.outputs),
+                modes=[Reply(id=mid, width=w, height=h, name_len=len(n)) for (mid, w, h, n) in self.modes],
+                names="".join(n for (mid, w, h, n) in self.modes),
+                )
+    GetScreenResourcesCurrent = GetScreenResources
+
+    def GetScreenSizeRange(self, window):
+        return Reply(min_width=320, min_height=200, max_width=8192, max_height=8192)
+
+    def GetOutputPrimary(self, window):
+        return Reply(output=self.primary)
+
+    def GetOutputInfo(self, oid, ts):
+        o = self.outputs[oid]
+        return Reply(name=o['name'], connection=o['connection'], crtc=o['crtc'], crtcs=o['crtcs'], modes=o['modes'])
+
+    def GetCrtcInfo(self, cid, ts):
+        c = self.crtcs[cid]
+        w, h = self._crtc_size(c)
+        return Reply(x=c['x'], y=c['y'], width=w, height=h, mode=c['mode'], rotation=c['rotation'], rotations=0xf, outputs=c['outputs'])
+
+    def SetCrtcConfig(self, cid, ts, config_ts, x, y, mode, rotation, n, outputs):
+        self.requests.append(('SetCrtcConfig', cid, x, y, mode, rotation, list(outputs)))
+        if cid in self.failing and mode:
+            return Reply(status=3) # RRSetConfigFailed
+        c = self.crtcs[cid]
+        for oid in c['outputs']:
+            self.outputs[oid]['crtc'] = 0
+        c.update(x=x, y=y, mode=mode, rotation=rotation, outputs=list(outputs))
+        for oid in outputs:
+            self.outputs[oid]['crtc'] = cid
+        self.events.append(NotifyEvent())
+        return Reply(status=0)
+
+    def SetScreenSizeChecked(self, window, width, height, mm_width, mm_height):
+        self.requests.append(('SetScreenSize', width, height))
+        self.size = (width, height)
+        self.events.append(ScreenChangeNotifyEvent())
+        return Reply()
+
+    def SetOutputPrimary(self, window, oid):
+        self.requests.append(('SetOutputPrimary', oid))
+        self.primary = oid
+        self.events.append(NotifyEvent())
+
+_server = None
+
+def _connect(display=None):
+    return _server
+
+def install():
+    """Make `import xcb` give the stand-in; connections go to the FakeServer
+    that is in use"""
+    xcb = types.ModuleType('xcb')
+    xcb.xproto = types.ModuleType('xcb.xproto')
+    xcb.randr = types.ModuleType('xcb.randr')
+    xcb.Exception = FakeError
+    xcb.connect = _connect
+    xcb.randr.key = 'randr'
+    xcb.randr.ScreenChangeNotifyEvent = ScreenChangeNotifyEvent
+    xcb.randr.NotifyEvent = NotifyEvent
+    sys.modules.update({'xcb': xcb, 'xcb.xproto': xcb.xproto, 'xcb.randr': xcb.randr})
+
+install()
+
+from screenlayout.auxiliary import Position
+from screenlayout.xrandr import XRandR
+
+#################### scenarios ####################
+
+EDP, HDMI = 0x60, 0x61
+CRTC1, CRTC2 = 0x40, 0x41
+M1080, M1080_50, M768 = 0x50, 0x51, 0x52
+
+def _server_with(**kwargs):
+    """A laptop panel and an HDMI output that both have 1920x1080 (at 60 and
+    50Hz, under the same name) and 1024x768, and can each use both CRTCs"""
+    defaults = dict(
+            modes=[(M1080, 1920, 1080, "1920x1080"), (M1080_50, 1920, 1080, "1920x1080"), (M768, 1024, 768, "1024x768")],
+            crtcs={
+                CRTC1: dict(x=0, y=0, mode=M1080, outputs=[EDP]),
+                CRTC2: dict(x=1920, y=0, mode=M1080, outputs=[HDMI]),
+                },
+            outputs={
+                EDP: dict(name="eDP-1", crtc=CRTC1, crtcs=[CRTC1, CRTC2], modes=[M1080, M1080_50, M768]),
+                HDMI: dict(name="HDMI-1", crtc=CRTC2, crtcs=[CRTC1, CRTC2], modes=[M1080, M1080_50, M768]),
+                },
+            primary=EDP,
+            )
+    defaults.update(kwargs)
+    return FakeServer(**defaults)
+
+def _loaded(server):
+    global _server
+    _server = server
+    x = XRandR(backend='xcb')
+    x.load_from_x()
+    return x
+
+def check_unchanged_mirror():
+    """cloned outputs that stay as they are get no requests"""
+    s = _server_with(
+            crtcs={
+                CRTC1: dict(x=0, y=0, mode=M1080, outputs=[EDP, HDMI]),
+                CRTC2: dict(x=0, y=0, mode=0),
+                },
+            )
+    s.outputs[HDMI]['crtc'] = CRTC1
+    x = _loaded(s)
+    assert tuple(x.configuration.outputs['HDMI-1'].position) == (0, 0)
+    x.save_to_x()
+    assert s.requests == [], s.requests
+
+def check_mirror_split():
+    """moving one of two clones gives it a CRTC of its own, and resizes the
+    screen once, before the CRTCs that need the new size are set"""
+    s = _server_with(
+            crtcs={
+                CRTC1: dict(x=0, y=0, mode=M1080, outputs=[EDP, HDMI]),
+                CRTC2: dict(x=0, y=0, mode=0),
+                },
+            )
+    s.outputs[HDMI]['crtc'] = CRTC1
+    x = _loaded(s)
+    x.configuration.outputs['HDMI-1'].position = Position((1920, 0))
+    x.save_to_x()
+    assert s.requests == [
+            ('SetScreenSize', 3840, 1080),
+            ('SetCrtcConfig', CRTC1, 0, 0, M1080, 1, [EDP]),
+            ('SetCrtcConfig', CRTC2, 1920, 0, M1080, 1, [HDMI]),
+            ], s.requests
+
+    x.load_from_x()
+    assert tuple(x.configuration.outputs['HDMI-1'].position) == (1920, 0)
+    assert tuple(x.configuration.virtual) == (3840, 1080)
+
+def check_refresh_rate_kept():
+    """of two modes that only differ in their refresh rate, the one the CRTC
+    runs is kept"""
+    s = _server_with()
+    s.crtcs[CRTC1]['mode'] = M1080_50
+    x = _loaded(s)
+    x.save_to_x()
+    assert s.requests == [], s.requests
+
+    # the other output's CRTC would not fit the smaller screen for a moment
+    x.load_from_x()
+    x.configuration.outputs['HDMI-1'].mode = x.state.outputs['HDMI-1'].get_mode("1024x768")
+    x.save_to_x()
+    assert s.requests == [
+            ('SetCrtcConfig', CRTC2, 0, 0, 0, 1, []),
+            ('SetScreenSize', 2944, 1080),
+            ('SetCrtcConfig', CRTC2, 1920, 0, M768, 1, [HDMI]),
+            ], s.requests
+
+def check_primary_cleared():
+    """an output that loses its primary flag without another one getting it
+    leaves the server without primary output"""
+    s = _server_with()
+    x = _loaded(s)
+    assert x.configuration.outputs['eDP-1'].primary
+    x.configuration.outputs['eDP-1'].primary = False
+    x.save_to_x()
+    assert s.requests == [('SetOutputPrimary', 0)], s.requests
+
+def check_scaled():
+    """outputs with --scale are loaded with the size of their mode, stay
+    as they are when nothing changes, and keep the screen large enough"""
+    s = _server_with()
+    s.crtcs[CRTC2]['scale'] = 1.5
+    s.size = (1920 + 2880, 1620)
+    x = _loaded(s)
+    assert tuple(x.configuration.outputs['HDMI-1'].size) == (1920, 1080)
+    x.save_to_x()
+    assert s.requests == [], s.requests
+
+    x.load_from_x()
+    x.configuration.outputs['eDP-1'].mode = x.state.outputs['eDP-1'].get_mode("1024x768")
+    x.save_to_x()
+    assert s.requests == [
+            ('SetCrtcConfig', CRTC1, 0, 0, M768, 1, [EDP]),
+            ], s.requests
+
+def check_rolled_back():
+    """when setting a crtc fails, the crtcs and the screen size are set
+    back as they were"""
+    s = _server_with(
+            crtcs={
+                CRTC1: dict(x=0, y=0, mode=M1080, outputs=[EDP]),
+                CRTC2: dict(x=0, y=0, mode=0),
+                },
+            failing=[CRTC2],
+            )
+    s.outputs[HDMI]['crtc'] = 0
+    x = _loaded(s)
+    x.configuration.outputs['eDP-1'].position = Position((1024, 0))
+    o = x.configuration.outputs['HDMI-1']
+    o.active = True
+    o.mode = x.state.outputs['HDMI-1'].get_mode("1024x768")
+    o.position = Position((0, 0))
+    o.rotation = x.configuration.outputs['eDP-1'].rotation
+    try:
+        x.save_to_x()
+    except Exception:
+        pass
+    else:
+        assert False, "the failure was not reported"
+    assert s.requests == [
+            ('SetScreenSize', 2944, 1080),
+            ('SetCrtcConfig', CRTC1, 1024, 0, M1080, 1, [EDP]),
+            ('SetCrtcConfig', CRTC2, 0, 0, M768, 1, [HDMI]),
+            # rollback
+            ('SetCrtcConfig', CRTC1, 0, 0, 0, 1, []),
+            ('SetCrtcConfig', CRTC2, 0, 0, 0, 1, []),
+            ('SetScreenSize', 1920, 1080),
+            ('SetCrtcConfig', CRTC1, 0, 0, M1080, 1, [EDP]),
+            ], s.requests
+    assert s.size == (1920, 1080)
+
+CHECKS = [
+        check_unchanged_mirror,
+        check_mirror_split,
+        check_refresh_rate_kept,
+        check_primary_cleared,
+        check_scaled,
+        check_rolled_back,
+        ]
+
+def main():
+    failed = False
+    for check in CHECKS:
+        try:
+            check()
+        except AssertionError, e:
+            failed = True
+            print "%-28s FAILED: %s"%(check.__name__, e)
+        else:
+            print "%-28s ok"%check.__name__
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
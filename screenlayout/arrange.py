@@ -0,0 +1,174 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Automatic placement of outputs
+
+Every strategy takes a loaded XRandR object and the names of the outputs to
+place (by default, all active ones, sorted by name), and
+returns a copy of the configuration (or of the one passed as `configuration`)
+in which those outputs are positioned without overlapping each other inside
+state.virtual.max. Outputs to be placed have to be active or at least have a
+mode; see activate(). If they don't fit, InadequateConfiguration is raised."""
+
+import heapq
+
+from .auxiliary import Position, NORMAL, InadequateConfiguration
+from .validation import RectangleIndex, overlap
+
+import gettext
+gettext.install('arandr')
+
+def preferred_mode(xrandr, on):
+    """The mode an output should be switched on with: the preferred one
+    (which xrandr lists first), or the largest one that fits the virtual
+    screen if that doesn't"""
+    vmax = xrandr.state.virtual.max
+    os = xrandr.state.outputs[on]
+    if os.modes and os.modes[0][0] <= vmax[0] and os.modes[0][1] <= vmax[1]:
+        return os.modes[0]
+    mode = os.get_largest_mode(vmax)
+    if mode is None:
+        raise InadequateConfiguration("Smallest mode too large for virtual.")
+    return mode
+
+def activate(xrandr, configuration, on):
+    """Switch an output on in `configuration`, keeping its mode and rotation
+    if it had been on before. Its position is left for a strategy to set."""
+    o = configuration.outputs[on]
+    if not hasattr(o, 'position'):
+        o.mode = preferred_mode(xrandr, on)
+        o.rotation = NORMAL
+        o.position = Position((0, 0))
+    o.active = True
+
+def _prepare(xrandr, outputs, configuration):
+    configuration = (configuration or xrandr.configuration).copy()
+    if outputs is None:
+        outputs = sorted(on for on in xrandr.outputs if configuration.outputs[on].active)
+    return configuration, list(outputs)
+
+def _fits(xrandr, configuration, outputs):
+    vmax = xrandr.state.virtual.max
+    for on in outputs:
+        o = configuration.outputs[on]
+        if o.position[0] + o.size[0] > vmax[0] or o.position[1] + o.size[1] > vmax[1]:
+            raise InadequateConfiguration(_("A part of an output is outside the virtual screen."))
+    return configuration
+
+#################### strategies ####################
+
+def grid(xrandr, outputs=None, columns=None, configuration=None):
+    """Place the outputs row by row in a grid of `columns` columns (by
+    default, as many as make it about square). Each column is as wide as
+    its widest output, and each row as high as its highest."""
+    configuration, outputs = _prepare(xrandr, outputs, configuration)
+    if not outputs:
+        return configuration
+    if columns is None:
+        columns = 1
+        while columns * columns < len(outputs):
+            columns += 1
+
+    sizes = [configuration.outputs[on].size for on in outputs]
+    widths = [0] * columns
+    heights = [0] * ((len(outputs) + columns - 1) // columns)
+    for i, size in enumerate(sizes):
+        widths[i % columns] = max(widths[i % columns], size[0])
+        heights[i // columns] = max(heights[i // columns], size[1])
+
+    lefts = [sum(widths[:c]) for c in range(columns)]
+    tops = [sum(heights[:r]) for r in range(len(heights))]
+    for i, on in enumerate(outputs):
+        configuration.outputs[on].position = Position((lefts[i % columns], tops[i // columns]))
+    return _fits(xrandr, configuration, outputs)
+
+def row(xrandr, outputs=None, configuration=None):
+    """Place the outputs next to each other, left to right, aligned at
+    their top edges"""
+    configuration, outputs = _prepare(xrandr, outputs, configuration)
+    left = 0
+    for on in outputs:
+        o = configuration.outputs[on]
+        o.position = Position((left, 0))
+        left += o.size[0]
+    return _fits(xrandr, configuration, outputs)
+
+def column(xrandr, outputs=None, configuration=None):
+    """Place the outputs below each other, top to bottom, aligned at their
+    left edges"""
+    configuration, outputs = _prepare(xrandr, outputs, configuration)
+    top = 0
+    for on in outputs:
+        o = configuration.outputs[on]
+        o.position = Position((0, top))
+        top += o.size[1]
+    return _fits(xrandr, configuration, outputs)
+
+def pack(xrandr, outputs=None, configuration=None):
+    """Place the outputs one by one next to the active outputs that are not
+    being placed (and the ones placed before them): each goes to the
+    right of or below an output that is already there, at the free
+    position that comes first in reading order."""
+    configuration, outputs = _prepare(xrandr, outputs, configuration)
+    vmax = xrandr.state.virtual.max
+    placing = set(outputs)
+
+    index = RectangleIndex()
+    candidates = [] # heap of (top, left)
+    def add(on, left, top, size):
+        rect = (left, top, left + size[0], top + size[1])
+        index.set(on, rect)
+        heapq.heappush(candidates, (top, rect[2]))
+        heapq.heappush(candidates, (rect[3], left))
+
+    for on in xrandr.outputs:
+        o = configuration.outputs[on]
+        if o.active and on not in placing:
+            add(on, o.position[0], o.position[1], o.size)
+    if not index.rects:
+        heapq.heappush(candidates, (0, 0))
+
+    for on in outputs:
+        size = configuration.outputs[on].size
+        skipped = []
+        while candidates:
+            top, left = heapq.heappop(candidates)
+            rect = (left, top, left + size[0], top + size[1])
+            if rect[2] > vmax[0] or rect[3] > vmax[1]:
+                skipped.append((top, left)) # might fit a smaller output
+                continue
+            blocking = [other for other in index.near(rect) if overlap(rect, index.rects[other])]
+            if not blocking:
+                break
+            covered = any(r[0] <= left < r[2] and r[1] <= top < r[3] for r in (index.rects[b] for b in blocking))
+            if not covered: # positions inside an output stay occupied for good
+                skipped.append((top, left))
+        else:
+            raise InadequateConfiguration(_("The outputs don't fit into the virtual screen."))
+        for c in skipped:
+            heapq.heappush(candidates, c)
+
+        configuration.outputs[on].position = Position((left, top))
+        add(on, left, top, size)
+
+    return configuration
+
+STRATEGIES = {
+        'grid': grid,
+        'row': row,
+        'column': column,
+        'pack': pack,
+        }
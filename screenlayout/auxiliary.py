@@ -25,6 +25,12 @@ class FileSyntaxError(FileLoadError):
 class InadequateConfiguration(Exception):
     """A configuration is incompatible with the current state of X."""
 
+class XRandRTimeout(Exception):
+    """xrandr did not finish in time and was killed."""
+
+class CallCancelled(Exception):
+    """A pending call to xrandr was cancelled."""
+
 
 class BetterList(list):
     """List that can be split like a string"""
@@ -47,6 +53,7 @@ class BetterList(list):
 
 class Size(tuple):
     """2-tuple of width and height that can be created from a '<width>x<height>' string"""
+    __slots__ = ()
     def __new__(cls, arg):
         if isinstance(arg, basestring):
             arg = [int(x) for x in arg.split("x")]
@@ -59,31 +66,28 @@ class Size(tuple):
     def __str__(self):
         return "%dx%d"%self
 
-class NamedSize(object):
-    """Object that behaves like a size, but has an additional name attribute"""
-    def __init__(self, size, name):
-        self._size = size
+class NamedSize(Size):
+    """Size that has an additional name attribute
+
+    (Subclasses of tuple can't have slots of their own, so the name lives in
+    the instance dictionary; indexing and iterating is still native.)"""
+    def __new__(cls, size, name):
+        self = super(NamedSize, cls).__new__(cls, size)
         self.name = name
+        return self
+
+    def __getnewargs__(self):
+        return (tuple(self), self.name)
 
-    width = property(lambda self:self[0])
-    height = property(lambda self:self[1])
     def __str__(self):
-        if "%dx%d"%(self.width, self.height) in self.name:
+        if "%dx%d"%self in self.name:
             return self.name
         else:
-            return "%s (%dx%d)"%(self.name, self.width, self.height)
-
-    def __iter__(self):
-        return self._size.__iter__()
-
-    def __getitem__(self, i):
-        return self._size[i]
-
-    def __len__(self):
-        return 2
+            return "%s (%dx%d)"%((self.name,) + self)
 
 class Position(tuple):
     """2-tuple of left and top that can be created from a '<left>x<top>' string"""
+    __slots__ = ()
     def __new__(cls, arg):
         if isinstance(arg, basestring):
             arg = [int(x) for x in arg.split("x")]
@@ -99,6 +103,7 @@ class Position(tuple):
 class Geometry(tuple):
     """4-tuple of width, height, left and top that can be created from an XParseGeometry style string"""
     # FIXME: use XParseGeometry instead of an own incomplete implementation
+    __slots__ = ()
     def __new__(cls, width, height=None, left=None, top=None):
         if isinstance(width, basestring):
             width,rest = width.split("x")
@@ -118,13 +123,28 @@ class Geometry(tuple):
 
 
 class Rotation(str):
-    """String that represents a rotation by a multiple of 90 degree"""
-    def __init__(self, original_me):
-        if self not in ('left','right','normal','inverted'):
-            raise Exception("No know rotation.")
-    is_odd = property(lambda self: self in ('left','right'))
+    """String that represents a rotation by a multiple of 90 degree
+
+    There is only one instance per rotation, so they can be compared by
+    identity; `is_odd` and `angle` are plain attributes."""
     _angles = {'left':pi/2,'inverted':pi,'right':3*pi/2,'normal':0}
-    angle = property(lambda self: Rotation._angles[self])
+    _instances = {}
+    def __new__(cls, name):
+        try:
+            return cls._instances[name]
+        except KeyError:
+            pass
+        if name not in cls._angles:
+            raise Exception("No know rotation.")
+        self = super(Rotation, cls).__new__(cls, name)
+        self.is_odd = name in ('left','right')
+        self.angle = cls._angles[name]
+        cls._instances[name] = self
+        return self
+
+    def __reduce__(self):
+        return (Rotation, (str(self),))
+
     def __repr__(self):
         return '<Rotation %s>'%self
 
@@ -0,0 +1,136 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Loading and applying layouts on many X displays at once
+
+Every display is handled by an XRandR object of its own in a worker thread;
+at most `jobs` displays are worked on at the same time. A display that takes
+longer than `timeout` seconds is reported as failed with a DisplayTimeout.
+
+Each worker gets a deadline of that many seconds for all it does with
+xrandr, after which the xrandr process it waits for is killed, so workers end
+soon after their display is given up on. Until they do, they still count
+against `jobs`. As xcb calls can't be interrupted that way, the xcb backend
+can't be used together with a timeout."""
+
+import time
+import Queue
+import threading
+
+from .xrandr import XRandR
+
+class DisplayTimeout(Exception):
+    """A display did not answer in time."""
+
+class Result(object):
+    """Outcome of working on a single display: if `error` is None, `xrandr`
+    is the XRandR object that was used (loaded from X after applying, if a
+    layout was applied); otherwise, `error` is the exception that occurred.
+    `duration` is the number of seconds it took (or was waited for)."""
+    def __init__(self, display, xrandr=None, error=None, duration=None):
+        self.display = display
+        self.xrandr = xrandr
+        self.error = error
+        self.duration = duration
+
+    ok = property(lambda self: self.error is None)
+
+    def __repr__(self):
+        return '<%s %s %s>'%(type(self).__name__, self.display, 'ok' if self.ok else repr(self.error))
+
+def _work(display, action, deadline, kwargs, done):
+    start = time.time()
+    try:
+        x = XRandR(display=display, deadline=deadline, **kwargs)
+        action(x)
+    except Exception, e:
+        done.put(Result(display, error=e, duration=time.time() - start))
+    else:
+        done.put(Result(display, xrandr=x, duration=time.time() - start))
+
+def run(displays, action, jobs=8, timeout=None, **kwargs):
+    """Call `action` with an XRandR object for each of the `displays` (other
+    keyword arguments are passed to XRandR), and return a dictionary mapping
+    each display to a Result.
+
+    If `timeout` is given, no display is waited for longer than that many
+    seconds (but run() only returns once the workers of displays that
+    timed out have stopped their xrandr, shortly after). That needs the xrandr backend; ValueError is raised for xcb."""
+    if timeout is not None and kwargs.get('backend') == 'xcb':
+        # a hanging worker would keep its place in the pool forever
+        raise ValueError("The xcb backend can't be interrupted, so it can't be used with a timeout.")
+
+    pending = []
+    for d in displays:
+        if d not in pending:
+            pending.append(d)
+    running = {} # display -> start time
+    abandoned = set() # displays that timed out, but whose workers still run
+    results = {}
+    done = Queue.Queue()
+
+    while pending or running:
+        while pending and len(running) + len(abandoned) < jobs:
+            d = pending.pop(0)
+            running[d] = time.time()
+            deadline = None if timeout is None else running[d] + timeout
+            t = threading.Thread(target=_work, args=(d, action, deadline, kwargs, done), name='fleet %s'%d)
+            t.daemon = True
+            t.start()
+
+        if timeout is None or not running:
+            # blocking Queue.get calls without timeout can't be interrupted by ctrl-c
+            wait = 3600
+        else:
+            wait = max(0, min(running.values()) + timeout - time.time())
+
+        try:
+            r = done.get(timeout=wait)
+        except Queue.Empty:
+            now = time.time()
+            for d, start in running.items():
+                if timeout is not None and now - start >= timeout:
+                    results[d] = Result(d, error=DisplayTimeout("No answer from %s within %s seconds."%(d, timeout)), duration=now - start)
+                    del running[d]
+                    abandoned.add(d)
+            continue
+
+        if r.display in running:
+            del running[r.display]
+            results[r.display] = r
+        else: # it has already timed out
+            abandoned.discard(r.display)
+
+    # workers that were given up on end at their deadline, killing their
+    # xrandr; returning earlier could leave those running (eg. when the
+    # program exits, which stops the threads)
+    while abandoned:
+        abandoned.discard(done.get(timeout=3600).display)
+
+    return results
+
+def load(displays, **kwargs):
+    """Load the current state of all `displays`; see run()"""
+    return run(displays, lambda x: x.load_from_x(), **kwargs)
+
+def apply(displays, data, **kwargs):
+    """Apply the layout given as shell script contents (as with
+    XRandR.load_from_string) to all `displays`; see run()"""
+    def action(x):
+        x.load_from_string(data)
+        x.save_to_x(only_changes=True)
+        x.load_from_x()
+    return run(displays, action, **kwargs)
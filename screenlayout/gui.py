@@ -24,6 +24,7 @@ import gtk
 
 from . import widget
 from .metacity import show_keybinder
+from .auxiliary import InadequateConfiguration
 
 from .meta import __version__, TRANSLATORS, COPYRIGHT, PROGRAMNAME, PROGRAMDESCRIPTION
 
@@ -79,6 +80,12 @@ class Application(object):
                 <separator />
                 <menuitem action="Apply" />
                 <menuitem action="LayoutSettings" />
+                <menu action="Arrange">
+                    <menuitem action="ArrangeGrid" />
+                    <menuitem action="ArrangeRow" />
+                    <menuitem action="ArrangeColumn" />
+                    <menuitem action="ArrangePack" />
+                </menu>
                 <separator />
                 <menuitem action="Quit" />
             </menu>
@@ -107,7 +114,7 @@ class Application(object):
     </ui>
     """
 
-    def __init__(self, file=None, randr_display=None, force_version=False):
+    def __init__(self, file=None, randr_display=None, force_version=False, randr_backend=None):
         self.window = window = gtk.Window()
         window.props.title = "Screen Layout Editor"
 
@@ -122,6 +129,12 @@ class Application(object):
             ("Apply", gtk.STOCK_APPLY, None, '<Control>Return', None, self.do_apply),
             ("LayoutSettings", gtk.STOCK_PROPERTIES, None, '<Alt>Return', None, self.do_open_properties),
 
+            ("Arrange", None, _("A_rrange")),
+            ("ArrangeGrid", None, _("In a _grid"), None, None, lambda action: self.do_arrange('grid')),
+            ("ArrangeRow", None, _("In a _row"), None, None, lambda action: self.do_arrange('row')),
+            ("ArrangeColumn", None, _("In a _column"), None, None, lambda action: self.do_arrange('column')),
+            ("ArrangePack", None, _("_Packed"), None, None, lambda action: self.do_arrange('pack')),
+
             ("Quit", gtk.STOCK_QUIT, None, None, None, gtk.main_quit),
 
 
@@ -154,7 +167,7 @@ class Application(object):
         self.uimanager.add_ui_from_string(self.uixml)
 
         # widget
-        self.widget = widget.ARandRWidget(display=randr_display, force_version=force_version)
+        self.widget = widget.ARandRWidget(display=randr_display, force_version=force_version, backend=randr_backend)
         if file is None:
             self.filetemplate = self.widget.load_from_x()
         else:
@@ -218,9 +231,18 @@ class Application(object):
             d.run()
             d.destroy()
 
+    def do_arrange(self, strategy):
+        try:
+            self.widget.auto_arrange(strategy)
+        except InadequateConfiguration, e:
+            self.widget.error_message(_("The outputs can't be arranged like this:\n%s")%e)
+
     @actioncallback
     def do_new(self):
-        self.filetemplate = self.widget.load_from_x()
+        try:
+            self.filetemplate = self.widget.load_from_x()
+        except Exception, e:
+            self.widget.error_message(_("XRandR failed:\n%s")%e)
 
     @actioncallback
     def do_open(self):
@@ -232,7 +254,10 @@ class Application(object):
         if result == gtk.RESPONSE_ACCEPT:
             assert len(filenames) == 1
             f = filenames[0]
-            self.filetemplate = self.widget.load_from_file(f)
+            try:
+                self.filetemplate = self.widget.load_from_file(f)
+            except Exception, e:
+                self.widget.error_message(_("The layout could not be loaded:\n%s")%e)
 
     @actioncallback
     def do_save_as(self):
@@ -304,6 +329,7 @@ def main():
     p = optparse.OptionParser(usage="%prog [savedfile]", description="Another XRandrR GUI", version="%%prog %s"%__version__)
     p.add_option('--randr-display', help='Use D as display for xrandr (but still show the GUI on the display from the environment; e.g. `localhost:10.0`)', metavar='D')
     p.add_option('--force-version', help='Even run with untested XRandR versions', action='store_true')
+    p.add_option('--randr-backend', help='Talk to the X server using B, which is either `xrandr` (default) or `xcb`', metavar='B', type='choice', choices=['xcb', 'xrandr'])
 
     (options, args) = p.parse_args()
     if len(args) == 0:
@@ -316,6 +342,7 @@ def main():
     a = Application(
             file=file_to_open,
             randr_display=options.randr_display,
-            force_version=options.force_version
+            force_version=options.force_version,
+            randr_backend=options.randr_backend,
             )
     a.run()
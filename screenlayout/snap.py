@@ -14,33 +14,107 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
+
 from .auxiliary import Position
 
+# kinds of guides; at equal distance, edges win over centers
+EDGE = 0
+CENTER = 1
+
+class Guide(tuple):
+    """A line something was snapped to: `orientation` is 'vertical' or
+    'horizontal', `line` the x or y coordinate of the line, and `kind`
+    EDGE or CENTER."""
+    __slots__ = ()
+    def __new__(cls, orientation, line, kind):
+        return super(Guide, cls).__new__(cls, (orientation, line, kind))
+    orientation = property(lambda self: self[0])
+    line = property(lambda self: self[1])
+    kind = property(lambda self: self[2])
+
+class _Edges(object):
+    """Sorted (coordinate, kind, line) entries (with repetitions) that can be
+    searched for the one with the coordinate nearest to a value"""
+    def __init__(self, entries=()):
+        self._entries = sorted(entries)
+
+    def nearest(self, value, tolerance):
+        """The entry whose coordinate is closest to `value` and less than
+        `tolerance` away from it, or None"""
+        entries = self._entries
+        # (value,) sorts before all entries at value
+        i = bisect.bisect_left(entries, (value,))
+        best = None
+        if i > 0:
+            # the last of the entries below value; the first of those at its coordinate
+            below = entries[i - 1][0]
+            j = bisect.bisect_left(entries, (below,), 0, i)
+            if value - below < tolerance:
+                best = entries[j]
+        if i < len(entries) and entries[i][0] - value < tolerance:
+            if best is None or entries[i][0] - value < value - best[0] or (entries[i][0] - value == value - best[0] and entries[i][1] < best[1]):
+                best = entries[i]
+        return best
+
 class Snap(object):
-    """Snap-to-edges manager"""
+    """Snap-to-edges manager for an object of a given size that is moved
+    among the (position, size) rectangles in `list`.
+
+    Besides aligning edges with edges, the object's center lines are
+    aligned with the rectangles' center lines, unless a rectangle is given
+    as (position, size, False), as is useful for boundaries. Suggestions
+    take O(log n)."""
     def __init__(self, size, tolerance, list):
+        self.size = size
         self.tolerance = tolerance
 
-        self.horizontal = set()
-        self.vertical = set()
-        for i in list:
-            self.vertical.add(i[0].left)
-            self.vertical.add(i[0].left+i[1].width)
-            self.horizontal.add(i[0].top)
-            self.horizontal.add(i[0].top+i[1].height)
+        vertical = []
+        horizontal = []
+        for rectangle in list:
+            v, h = self._edges(*rectangle)
+            vertical.extend(v)
+            horizontal.extend(h)
+        self.vertical = _Edges(vertical)
+        self.horizontal = _Edges(horizontal)
 
-            self.vertical.add(i[0].left-size.width)
-            self.vertical.add(i[0].left+i[1].width-size.width)
-            self.horizontal.add(i[0].top-size.height)
-            self.horizontal.add(i[0].top+i[1].height-size.height)
+    def _edges(self, position, size, centers=True):
+        """The positions at which the moved object would be aligned with the
+        given rectangle, as lists of vertical and horizontal
+        (position, kind, line) entries"""
+        vertical = []
+        horizontal = []
+        for (entries, start, length, own) in (
+                (vertical, position.left, size.width, self.size.width),
+                (horizontal, position.top, size.height, self.size.height),
+                ):
+            end = start + length
+            center = start + length//2
+            entries.extend([
+                (start, EDGE, start),
+                (end, EDGE, end),
+                (start - own, EDGE, start),
+                (end - own, EDGE, end),
+                ])
+            if centers:
+                entries.append((center - own//2, CENTER, center))
+        return vertical, horizontal
 
-    def suggest(self, position):
-        vertical = [x for x in self.vertical if abs(x-position[0])<self.tolerance]
-        horizontal = [y for y in self.horizontal if abs(y-position[1])<self.tolerance]
+    def snap(self, position):
+        """Return the position to snap to and a list of the Guides that
+        fired"""
+        x = self.vertical.nearest(position[0], self.tolerance)
+        y = self.horizontal.nearest(position[1], self.tolerance)
 
-        if vertical:
-            position = Position((vertical[0], position[1]))
-        if horizontal:
-            position = Position((position[0], horizontal[0]))
+        guides = []
+        if x is not None:
+            position = Position((x[0], position[1]))
+            guides.append(Guide('vertical', x[2], x[1]))
+        if y is not None:
+            position = Position((position[0], y[0]))
+            guides.append(Guide('horizontal', y[2], y[1]))
 
-        return position
+        return position, guides
+
+    def suggest(self, position):
+        return self.snap(position)[0]
@@ -0,0 +1,154 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Snapshots of what an XRandR object knows about a machine
+
+A snapshot contains the complete XRandR.State and XRandR.Configuration (unlike
+a layout script, which only has the latter), so a machine can be captured once
+and layouts can be validated, compared and shown for it without an X server.
+
+Snapshots are JSON objects like
+
+    {"format": "arandr-snapshot", "version": 1,
+     "features": ["primary"],
+     "screen": {"min": [320, 200], "max": [8192, 8192], "current": [1920, 1080]},
+     "modes": [["1920x1080", 1920, 1080], ...],
+     "outputs": [{"name": "HDMI-1", "connected": true,
+                  "rotations": ["normal", "left"], "modes": [0, ...],
+                  "active": true, "primary": true, "mode": 0,
+                  "position": [0, 0], "rotation": "normal"}, ...]}
+
+where modes are stored once and referred to by their index. Inactive outputs
+have no "mode", "position" and "rotation"."""
+
+import json
+
+from .auxiliary import Size, Geometry, NamedSize, Rotation, FileLoadError
+from .xrandr import XRandR, Feature
+
+FORMAT = 'arandr-snapshot'
+VERSION = 1
+
+_FEATURES = {
+        Feature.PRIMARY: 'primary',
+        }
+
+def dumps(xrandr):
+    """Return a snapshot of a loaded XRandR object as a string"""
+    modes = []
+    mode_indices = {} # (name, width, height) -> index in modes
+    def mode_index(m):
+        key = (m.name, m[0], m[1])
+        i = mode_indices.get(key)
+        if i is None:
+            i = mode_indices[key] = len(modes)
+            modes.append(list(key))
+        return i
+
+    outputs = []
+    for on in sorted(xrandr.state.outputs):
+        os = xrandr.state.outputs[on]
+        oc = xrandr.configuration.outputs[on]
+        o = {
+                'name': on,
+                'connected': os.connected,
+                'rotations': sorted(os.rotations),
+                'modes': [mode_index(m) for m in os.modes],
+                'active': oc.active,
+                'primary': oc.primary,
+                }
+        if oc.active:
+            o['mode'] = mode_index(oc.mode)
+            o['position'] = list(oc.position)
+            o['rotation'] = str(oc.rotation)
+        outputs.append(o)
+
+    return json.dumps({
+        'format': FORMAT,
+        'version': VERSION,
+        'features': sorted(name for (f, name) in _FEATURES.items() if f in xrandr.features),
+        'screen': {
+            'min': list(xrandr.state.virtual.min),
+            'max': list(xrandr.state.virtual.max),
+            'current': list(xrandr.configuration.virtual),
+            },
+        'modes': modes,
+        'outputs': outputs,
+        }, separators=(',', ':'))
+
+def dump(xrandr, f):
+    f.write(dumps(xrandr))
+
+def loads(data, xrandr=None):
+    """Fill an XRandR object from a snapshot string, as if it had been loaded
+    from X, and return it. Unless one is passed in, an offline XRandR is
+    created; only an offline one takes the snapshot as what was loaded from
+    X (see XRandR.get_changes)."""
+    try:
+        s = json.loads(data)
+    except ValueError, e:
+        raise FileLoadError("Not a snapshot: %s"%e)
+    if not isinstance(s, dict) or s.get('format') != FORMAT:
+        raise FileLoadError("Not a snapshot.")
+    if s.get('version') != VERSION:
+        raise FileLoadError("Unsupported snapshot version %r."%s.get('version'))
+
+    if xrandr is None:
+        xrandr = XRandR(backend='offline')
+
+    try:
+        xrandr.features = set(f for (f, name) in _FEATURES.items() if name in s['features'])
+
+        state = xrandr.State()
+        configuration = xrandr.Configuration(xrandr)
+        screen = s['screen']
+        state.virtual = state.Virtual(min=Size(screen['min']), max=Size(screen['max']))
+        configuration.virtual = Size(screen['current'])
+
+        # names come back as unicode objects, but are str everywhere else
+        # (the current mode of an output can lack a name)
+        modes = [NamedSize(Size((w, h)), name=name if name is None else name.encode('utf-8')) for (name, w, h) in s['modes']]
+
+        for o in s['outputs']:
+            os = state.Output(o['name'].encode('utf-8'))
+            os.connected = o['connected']
+            os.rotations = set(Rotation(r) for r in o['rotations'])
+            for i in o['modes']:
+                os.add_mode(modes[i])
+            state.outputs[os.name] = os
+
+            if o['active']:
+                mode = modes[o['mode']]
+                rotation = Rotation(o['rotation'])
+                size = tuple(reversed(mode)) if rotation.is_odd else tuple(mode)
+                geometry = Geometry(size[0], size[1], o['position'][0], o['position'][1])
+                configuration.outputs[os.name] = configuration.OutputConfiguration(True, o['primary'], geometry, rotation, mode.name)
+            else:
+                configuration.outputs[os.name] = configuration.OutputConfiguration(False, o['primary'], None, None, None)
+    except (KeyError, IndexError, TypeError, ValueError), e:
+        raise FileLoadError("Broken snapshot: %r"%e)
+
+    xrandr.state = state
+    xrandr.configuration = configuration
+    if xrandr.backend == 'offline':
+        xrandr._loaded = (state, configuration.copy())
+    else:
+        # a snapshot is not what X has; the next load has to ask X again
+        xrandr._loaded = None
+    return xrandr
+
+def load(f, xrandr=None):
+    return loads(f.read(), xrandr)
@@ -0,0 +1,334 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Incremental validation of configurations while they are edited"""
+
+import bisect
+
+from .auxiliary import Size, InadequateConfiguration
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import gettext
+gettext.install('arandr')
+
+def _remove(sortedlist, item):
+    del sortedlist[bisect.bisect_left(sortedlist, item)]
+
+class RectangleIndex(object):
+    """Named rectangles (left, top, right, bottom), kept sorted by their left
+    edges so that those near a given rectangle can be found by bisection.
+
+    Only rectangles whose left edge lies between the query's left edge minus
+    the widest rectangle's width and the query's right edge need to be looked
+    at; for layouts of similarly sized outputs (like video walls), that is a
+    handful independent of the layout's size."""
+    def __init__(self):
+        self.rects = {}
+        self._lefts = [] # (left, name)
+        self._widths = []
+
+    def __contains__(self, name):
+        return name in self.rects
+
+    def set(self, name, rect):
+        if name in self.rects:
+            self.remove(name)
+        self.rects[name] = rect
+        bisect.insort(self._lefts, (rect[0], name))
+        bisect.insort(self._widths, rect[2] - rect[0])
+
+    def remove(self, name):
+        rect = self.rects.pop(name)
+        _remove(self._lefts, (rect[0], name))
+        _remove(self._widths, rect[2] - rect[0])
+
+    def near(self, rect):
+        """Names of the rectangles that overlap or touch `rect`"""
+        if not self._widths:
+            return []
+        left, top, right, bottom = rect
+        start = bisect.bisect_left(self._lefts, (left - self._widths[-1],))
+        end = bisect.bisect_left(self._lefts, (right + 1,), start) # a 1-tuple sorts before all 2-tuples starting alike
+        result = []
+        for l, name in self._lefts[start:end]:
+            r = self.rects[name]
+            if r[2] >= left and r[1] <= bottom and r[3] >= top:
+                result.append(name)
+        return result
+
+class GridIndex(object):
+    """Named rectangles (left, top, right, bottom) sorted into a uniform grid
+    of square cells, so that the ones at a point are found in constant time
+    (for outputs that are not much smaller than a cell)"""
+    def __init__(self, cell=512):
+        self.cell = cell
+        self.rects = {}
+        self._cells = {} # (column, row) -> set of names
+
+    def __contains__(self, name):
+        return name in self.rects
+
+    def _cellrange(self, left, top, right, bottom):
+        c = self.cell
+        return [(i, j) for i in range(left//c, right//c + 1) for j in range(top//c, bottom//c + 1)]
+
+    def set(self, name, rect):
+        if name in self.rects:
+            self.remove(name)
+        self.rects[name] = rect
+        # edges count as inside, so rectangles are entered into the cells they touch
+        for cell in self._cellrange(*rect):
+            self._cells.setdefault(cell, set()).add(name)
+
+    def remove(self, name):
+        rect = self.rects.pop(name)
+        for cell in self._cellrange(*rect):
+            names = self._cells[cell]
+            names.discard(name)
+            if not names:
+                del self._cells[cell]
+
+    def at(self, x, y, margin=0):
+        """Names of the rectangles that contain the point (x, y) or are at
+        most `margin` away from it in either direction"""
+        result = set()
+        for cell in self._cellrange(x - margin, y - margin, x + margin, y + margin):
+            for name in self._cells.get(cell, ()):
+                r = self.rects[name]
+                if r[0] - margin <= x <= r[2] + margin and r[1] - margin <= y <= r[3] + margin:
+                    result.add(name)
+        return result
+
+def overlap(a, b):
+    """Tell whether two rectangles share more than an edge"""
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+class IncrementalValidator(object):
+    """Validator for an XRandR object's configuration that is told which
+    output was changed, and only rechecks that one.
+
+    Besides the bounds check_configuration does (raising the same
+    InadequateConfiguration), it keeps track of which active outputs overlap
+    and which are adjacent (share a part of an edge), so that overlaps and
+    outputs that are detached from the rest of the layout can be reported
+    while editing. The size the framebuffer needs is kept up to date as
+    well."""
+    def __init__(self, xrandr):
+        self._xrandr = xrandr
+        self.index = RectangleIndex()
+        self.grid = GridIndex() # for hit testing
+        self._rights = []
+        self._bottoms = []
+        self._overlaps = {} # name -> set of names
+        self._neighbours = {} # name -> set of names
+
+        # a loaded configuration is taken as it is, even if it could not be
+        # applied; only edits are checked
+        for on in xrandr.configuration.outputs:
+            self.update(on, check=False)
+
+    def _rect(self, on):
+        o = self._xrandr.configuration.outputs[on]
+        if not o.active:
+            return None
+        position, size = o.position, o.size
+        return (position[0], position[1], position[0] + size[0], position[1] + size[1])
+
+    def check(self, on):
+        """Raise InadequateConfiguration if the output `on` can't be set up
+        the way it is configured, without updating anything"""
+        rect = self._rect(on)
+        if rect is None:
+            return
+        vmax = self._xrandr.state.virtual.max
+        if rect[2] > vmax[0] or rect[3] > vmax[1]:
+            raise InadequateConfiguration(_("A part of an output is outside the virtual screen."))
+        if rect[0] < 0 or rect[1] < 0:
+            raise InadequateConfiguration(_("An output is outside the virtual screen."))
+
+    def update(self, on, check=True):
+        """Check the output `on` (see check()) and, if it is fine, take its
+        new configuration into account"""
+        if check:
+            self.check(on)
+        rect = self._rect(on)
+
+        if on in self.index:
+            old = self.index.rects[on]
+            _remove(self._rights, old[2])
+            _remove(self._bottoms, old[3])
+            self.index.remove(on)
+            self.grid.remove(on)
+            for other in self._overlaps.pop(on):
+                self._overlaps[other].discard(on)
+            for other in self._neighbours.pop(on):
+                self._neighbours[other].discard(on)
+
+        if rect is None:
+            return
+
+        overlaps = self._overlaps[on] = set()
+        neighbours = self._neighbours[on] = set()
+        for other in self.index.near(rect):
+            if overlap(rect, self.index.rects[other]):
+                overlaps.add(other)
+                self._overlaps[other].add(on)
+            elif self._adjacent(rect, self.index.rects[other]):
+                neighbours.add(other)
+                self._neighbours[other].add(on)
+
+        self.index.set(on, rect)
+        self.grid.set(on, rect)
+        bisect.insort(self._rights, rect[2])
+        bisect.insort(self._bottoms, rect[3])
+
+    @staticmethod
+    def _adjacent(a, b):
+        # for rectangles that touch but don't overlap: not only at a corner
+        return (a[0] < b[2] and b[0] < a[2]) or (a[1] < b[3] and b[1] < a[3])
+
+    def overlaps(self, on):
+        """Names of the active outputs that overlap the active output `on`"""
+        return self._overlaps[on]
+
+    def neighbours(self, on):
+        """Names of the active outputs that share a part of an edge with `on`"""
+        return self._neighbours[on]
+
+    def detached(self, on):
+        """Tell whether the active output `on` neither touches nor overlaps
+        any other, while there are other active outputs"""
+        return len(self.index.rects) > 1 and not self._overlaps[on] and not self._neighbours[on]
+
+    def overlapping(self):
+        """Names of all active outputs that overlap another one"""
+        return set(on for (on, others) in self._overlaps.items() if others)
+
+    def overlaps_at(self, on, position):
+        """Names of the active outputs that `on` would overlap at `position`"""
+        size = self._xrandr.configuration.outputs[on].size
+        rect = (position[0], position[1], position[0] + size[0], position[1] + size[1])
+        return set(other for other in self.index.near(rect) if other != on and overlap(rect, self.index.rects[other]))
+
+    def framebuffer(self):
+        """The size the framebuffer needs to have, like check_configuration
+        returns it"""
+        vmin = self._xrandr.state.virtual.min
+        return Size((
+            max(vmin[0], self._rights[-1] if self._rights else 0),
+            max(vmin[1], self._bottoms[-1] if self._bottoms else 0),
+            ))
+
+#################### batch validation ####################
+
+# above this many elements per array, candidates are checked in chunks
+_CHUNK = 1 << 22
+
+def _pack(xrandr, configurations):
+    """Rectangles (left, top, right, bottom) of the active outputs of each
+    configuration, in the order of xrandr.outputs, None for inactive ones"""
+    names = xrandr.outputs
+    result = []
+    for c in configurations:
+        rects = []
+        for on in names:
+            o = c.outputs[on]
+            if o.active:
+                position, size = o.position, o.size
+                rects.append((position[0], position[1], position[0] + size[0], position[1] + size[1]))
+            else:
+                rects.append(None)
+        result.append(rects)
+    return result
+
+def _verdict(rects, vmax, allow_overlap):
+    for r in rects:
+        if r is None:
+            continue
+        if r[2] > vmax[0] or r[3] > vmax[1]:
+            return InadequateConfiguration(_("A part of an output is outside the virtual screen."))
+        if r[0] < 0 or r[1] < 0:
+            return InadequateConfiguration(_("An output is outside the virtual screen."))
+    if not allow_overlap:
+        # sweep by left edge; only rectangles starting before r ends can overlap it
+        active = sorted(r for r in rects if r is not None)
+        for i, a in enumerate(active):
+            for b in active[i+1:]:
+                if b[0] >= a[2]:
+                    break
+                if overlap(a, b):
+                    return InadequateConfiguration(_("Outputs overlap."))
+    return None
+
+def _verdicts_numpy(packed, vmax, allow_overlap):
+    count = len(packed[0])
+    boxes = numpy.array([[r or (0, 0, 0, 0) for r in rects] for rects in packed], dtype=numpy.int64).reshape(len(packed), count, 4)
+    active = numpy.array([[r is not None for r in rects] for rects in packed], dtype=bool).reshape(len(packed), count)
+    left, top, right, bottom = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+
+    part_outside = active & ((right > vmax[0]) | (bottom > vmax[1]))
+    outside = active & ((left < 0) | (top < 0))
+    bad = part_outside | outside
+    # like check_configuration, report the first output that fails
+    first = bad.argmax(axis=1)
+    rows = numpy.arange(len(packed))
+    failed = bad.any(axis=1)
+    first_part = part_outside[rows, first]
+
+    overlapping = numpy.zeros(len(packed), dtype=bool)
+    if not allow_overlap and count > 1:
+        step = max(1, _CHUNK // (count * count))
+        for start in range(0, len(packed), step):
+            s = slice(start, start + step)
+            pairs = (left[s, :, None] < right[s, None, :]) & (left[s, None, :] < right[s, :, None]) & \
+                    (top[s, :, None] < bottom[s, None, :]) & (top[s, None, :] < bottom[s, :, None]) & \
+                    active[s, :, None] & active[s, None, :]
+            # every rectangle overlaps itself; only look above the diagonal
+            overlapping[s] = numpy.triu(pairs, 1).any(axis=(1, 2))
+
+    result = []
+    for i in range(len(packed)):
+        if failed[i]:
+            if first_part[i]:
+                result.append(InadequateConfiguration(_("A part of an output is outside the virtual screen.")))
+            else:
+                result.append(InadequateConfiguration(_("An output is outside the virtual screen.")))
+        elif overlapping[i]:
+            result.append(InadequateConfiguration(_("Outputs overlap.")))
+        else:
+            result.append(None)
+    return result
+
+def check_configurations(xrandr, configurations, allow_overlap=False):
+    """Validate many candidate configurations for the state of `xrandr` at
+    once, and return a list with a verdict for each: None if it can be
+    applied, otherwise the InadequateConfiguration that describes why not
+    (with the same message as check_configuration would raise).
+
+    Unlike check_configuration, overlapping outputs are rejected too, unless
+    `allow_overlap` is set. With NumPy installed, all candidates are checked
+    in a few vectorized passes; otherwise, one after the other."""
+    vmax = xrandr.state.virtual.max
+    packed = _pack(xrandr, configurations)
+    if not packed:
+        return []
+    if numpy is None or not packed[0]:
+        return [_verdict(rects, vmax, allow_overlap) for rects in packed]
+    return _verdicts_numpy(packed, vmax, allow_overlap)
@@ -17,23 +17,36 @@
 from __future__ import division
 import os
 import stat
+import cairo
 import pango
 import pangocairo
 import gobject, gtk
-from .auxiliary import Position, Size, NORMAL, ROTATIONS, InadequateConfiguration
+from .auxiliary import Position, Size, ROTATIONS, InadequateConfiguration
 from .xrandr import XRandR, Feature
-from .snap import Snap
+from .snap import Snap, CENTER
+from . import arrange
+from .validation import IncrementalValidator
 
 import gettext
 gettext.install('arandr')
 
+def _intersects_any(area, areas, margin=0):
+    x, y, w, h = area[0] - margin, area[1] - margin, area[2] + 2*margin, area[3] + 2*margin
+    for (x2, y2, w2, h2) in areas:
+        if x < x2 + w2 and x2 < x + w and y < y2 + h2 and y2 < y + h:
+            return True
+    return False
+
 class ARandRWidget(gtk.DrawingArea):
+    # drag motion is handled at most this often (in milliseconds; about 60Hz)
+    MOTION_INTERVAL = 16
+
     __gsignals__ = {
             'expose-event':'override', # FIXME: still needed?
             'changed':(gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
             }
 
-    def __init__(self, factor=8, display=None, force_version=False):
+    def __init__(self, factor=8, display=None, force_version=False, backend=None, timeout=10):
         super(ARandRWidget, self).__init__()
 
         self._factor = factor
@@ -45,12 +58,18 @@ class ARandRWidget(gtk.DrawingArea):
 
         self.setup_draganddrop()
 
-        self._xrandr = XRandR(display=display, force_version=force_version)
+        self._backing = None
+        self.connect('changed', lambda widget: self._drop_backing())
+
+        # a hanging xrandr must not freeze the user interface, not even for
+        # retries; calls that time out leave the loaded outputs as they are
+        self._xrandr = XRandR(display=display, force_version=force_version, backend=backend, timeout=timeout, retries=0)
 
     #################### widget features ####################
 
     def _set_factor(self, f):
         self._factor = f
+        self._drop_backing()
         self._update_size_request()
         self._force_repaint()
 
@@ -96,7 +115,18 @@ class ARandRWidget(gtk.DrawingArea):
 
     def _xrandr_was_reloaded(self):
         self.sequence = sorted(self._xrandr.outputs)
+        self._reindex_sequence()
         self._lastclick = (-1,-1)
+        self._guides = []
+        self._configuration_changed()
+
+    def _configuration_changed(self):
+        """Refresh everything that depends on the configuration after it was
+        replaced as a whole, keeping the stacking order and the pointer
+        state of the same outputs"""
+        self._layouts = {} # output name -> (key, layout, size); see _text_layout
+        self._validator = IncrementalValidator(self._xrandr)
+        self._update_overlapping()
 
         self._update_size_request()
         if self.window:
@@ -104,27 +134,30 @@ class ARandRWidget(gtk.DrawingArea):
         self.emit('changed')
 
     def save_to_x(self):
-        self._xrandr.save_to_x()
+        # without change events, only applying the changes would cost
+        # another `xrandr --verbose` before the one load_from_x runs
+        self._xrandr.save_to_x(only_changes=self._xrandr.events)
         self.load_from_x()
 
     def save_to_file(self, file, template=None, additional=None):
         data = self._xrandr.save_to_shellscript_string(template, additional)
         open(file, 'w').write(data)
         os.chmod(file, stat.S_IRWXU)
-        self.load_from_file(file)
 
     #################### doing changes ####################
 
     def _set_something(self, which, on, data):
+        damage = self._damage_begin([on])
         old = getattr(self._xrandr.configuration.outputs[on], which)
         setattr(self._xrandr.configuration.outputs[on], which, data)
         try:
-            self._xrandr.check_configuration()
+            self._validator.update(on)
         except InadequateConfiguration:
             setattr(self._xrandr.configuration.outputs[on], which, old)
             raise
 
-        self._force_repaint()
+        self._update_overlapping()
+        self._damage_end(damage)
         self.emit('changed')
 
     def set_position(self, on, pos):
@@ -136,6 +169,7 @@ class ARandRWidget(gtk.DrawingArea):
 
     def set_primary(self, on, primary):
         o = self._xrandr.configuration.outputs[on]
+        damage = self._damage_begin([on2 for on2 in self._xrandr.outputs if on2 == on or self._xrandr.configuration.outputs[on2].primary])
 
         if primary and not o.primary:
             for o2 in self._xrandr.outputs:
@@ -146,12 +180,13 @@ class ARandRWidget(gtk.DrawingArea):
         else:
             return
 
-        self._force_repaint()
+        self._damage_end(damage)
         self.emit('changed')
 
     def set_active(self, on, active):
-        v = self._xrandr.state.virtual
         o = self._xrandr.configuration.outputs[on]
+        damage = self._damage_begin([on])
+        old = (self._xrandr.configuration, o.active)
 
         if not active and o.active:
             o.active = False
@@ -160,28 +195,49 @@ class ARandRWidget(gtk.DrawingArea):
             if hasattr(o, 'position'):
                 o.active = True # nothing can go wrong, position already set
             else:
-                pos = Position((0,0))
-                for m in self._xrandr.state.outputs[on].modes:
-                    # determine first possible mode
-                    if m[0]<=v.max[0] and m[1]<=v.max[1]:
-                        mode = m
-                        break
-                else:
-                    raise InadequateConfiguration("Smallest mode too large for virtual.")
-
-                o.active = True
-                o.position = pos
-                o.mode = mode
-                o.rotation = NORMAL
+                # place it next to the outputs that are already on
+                cfg = self._xrandr.configuration.copy()
+                arrange.activate(self._xrandr, cfg, on)
+                self._xrandr.configuration = arrange.pack(self._xrandr, [on], cfg)
 
-        self._force_repaint()
+        try:
+            self._validator.update(on)
+        except InadequateConfiguration:
+            self._xrandr.configuration, o.active = old
+            raise
+        self._update_overlapping()
+        self._damage_end(damage)
         self.emit('changed')
 
+    def auto_arrange(self, strategy):
+        """Place all active outputs using one of arrange.STRATEGIES"""
+        self._xrandr.configuration = arrange.STRATEGIES[strategy](self._xrandr)
+        self._configuration_changed()
+
+    def _update_overlapping(self, dragging=None, position=None):
+        """Find the outputs to be painted as overlapping, taking the output
+        `dragging` to be at `position` if given"""
+        v = self._validator
+        if dragging is None:
+            self._overlapping = v.overlapping()
+            return
+        others = v.overlaps_at(dragging, position)
+        self._overlapping = self._overlapping_without(dragging) | others
+        if others:
+            self._overlapping.add(dragging)
+
+    def _overlapping_without(self, dragging):
+        """The outputs that overlap others apart from `dragging`"""
+        v = self._validator
+        return set(on for on in v.overlapping() if on != dragging and v.overlaps(on) - set([dragging]))
+
     #################### painting ####################
 
     def do_expose_event(self, event):
         cr = pangocairo.CairoContext(self.window.cairo_create())
-        cr.rectangle(event.area.x, event.area.y, event.area.width, event.area.height)
+        areas = event.region.get_rectangles()
+        for r in areas:
+            cr.rectangle(r.x, r.y, r.width, r.height)
         cr.clip()
 
         # clear
@@ -190,12 +246,79 @@ class ARandRWidget(gtk.DrawingArea):
         cr.fill()
         cr.save()
 
-        cr.scale(1/self.factor, 1/self.factor)
-        cr.set_line_width(self.factor*1.5)
+        f = self.factor
+        clip = [(r.x*f, r.y*f, r.width*f, r.height*f) for r in areas]
 
-        self._draw(self._xrandr, cr)
+        if self._draggingoutput:
+            # everything but the dragged output stays the same during a drag
+            cr.set_source_surface(self._static_layers(cr), 0, 0)
+            cr.paint()
 
-    def _draw(self, xrandr, cr):
+            cr.scale(1/self.factor, 1/self.factor)
+            cr.set_line_width(self.factor*1.5)
+            self._draw_retinted(self._xrandr, cr)
+            self._draw_outputs(self._xrandr, cr, [self._draggingoutput], clip)
+            self._draw_guides(self._xrandr, cr)
+        else:
+            cr.scale(1/self.factor, 1/self.factor)
+            cr.set_line_width(self.factor*1.5)
+            self._draw(self._xrandr, cr, clip)
+
+    def _static_layers(self, cr):
+        """A surface with the virtual screen and all outputs except the one
+        being dragged, like _draw paints them, as far as the widget shows
+        them. Outputs are tinted for overlapping each other only; see
+        _draw_retinted. It is kept until the widget changes, zooms, gets
+        resized or the drag ends."""
+        vmax = self._xrandr.state.virtual.max
+        shown = self.window.get_size()
+        size = (max(1, min(shown[0], int(-(-vmax[0]//self.factor)))), max(1, min(shown[1], int(-(-vmax[1]//self.factor)))))
+        key = (self._draggingoutput, size)
+        if self._backing is not None and self._backing[0] == key:
+            return self._backing[1]
+
+        tinted = self._overlapping_without(self._draggingoutput)
+        surface = cr.get_target().create_similar(cairo.CONTENT_COLOR, *size)
+        static = pangocairo.CairoContext(cairo.Context(surface))
+        static.scale(1/self.factor, 1/self.factor)
+        static.set_line_width(self.factor*1.5)
+        self._draw_background(self._xrandr, static)
+        self._draw_outputs(self._xrandr, static, [on for on in self.sequence if on != self._draggingoutput], overlapping=tinted)
+
+        self._backing = (key, surface, tinted)
+        return surface
+
+    def _draw_retinted(self, xrandr, cr):
+        """Paint the outputs of the static layers again that the dragged
+        output overlaps (or stopped overlapping), together with what is
+        below them, but only in their own area"""
+        changed = (self._overlapping ^ self._backing[2]) - set([self._draggingoutput])
+        if not changed:
+            return
+        cfg = xrandr.configuration
+        areas = [a for a in (self._output_extent(on, cfg.outputs[on]) for on in changed) if a is not None]
+        if not areas:
+            return
+        cr.save()
+        for area in areas:
+            cr.rectangle(*area)
+        cr.clip()
+        self._draw_background(xrandr, cr)
+        self._draw_outputs(xrandr, cr, [on for on in self.sequence if on != self._draggingoutput], areas)
+        cr.restore()
+
+    def _drop_backing(self):
+        self._backing = None
+
+    def _draw(self, xrandr, cr, clip=None):
+        """Paint the virtual screen and the outputs. If `clip` is given as a
+        list of (x, y, width, height) areas, outputs outside of all of them
+        are skipped."""
+        self._draw_background(xrandr, cr)
+        self._draw_outputs(xrandr, cr, self.sequence, clip)
+        self._draw_guides(xrandr, cr)
+
+    def _draw_background(self, xrandr, cr):
         cfg = xrandr.configuration
         state = xrandr.state
 
@@ -207,15 +330,24 @@ class ARandRWidget(gtk.DrawingArea):
         cr.rectangle(0,0,*cfg.virtual)
         cr.fill()
 
-        for on in self.sequence:
+    def _draw_outputs(self, xrandr, cr, names, clip=None, overlapping=None):
+        cfg = xrandr.configuration
+        if overlapping is None:
+            overlapping = self._overlapping
+
+        for on in names:
             o = cfg.outputs[on]
             if not o.active: continue
+            if clip is not None and not _intersects_any(self._output_extent(on, o), clip, self.factor*2): continue # margin for the outline
 
-            rect = (o.tentative_position if hasattr(o, 'tentative_position') else o.position) + tuple(o.size)
+            rect = (o.tentative_position if hasattr(o, 'tentative_position') else o.position) + o.size
             center = rect[0]+rect[2]/2, rect[1]+rect[3]/2
 
             # paint rectangle
-            cr.set_source_rgba(1,1,1,0.7)
+            if on in overlapping:
+                cr.set_source_rgba(1,0.75,0.75,0.7)
+            else:
+                cr.set_source_rgba(1,1,1,0.7)
             cr.rectangle(*rect)
             cr.fill()
             cr.set_source_rgb(0,0,0)
@@ -224,61 +356,160 @@ class ARandRWidget(gtk.DrawingArea):
 
             # set up for text
             cr.save()
-            textwidth = rect[3 if o.rotation.is_odd else 2]
-            widthperchar = textwidth/len(on)
-            textheight = int(widthperchar * 0.8) # i think this looks nice and won't overflow even for wide fonts
-
-            newdescr = pango.FontDescription("sans")
-            newdescr.set_size(textheight * pango.SCALE)
-
-            # create text
-            layout = cr.create_layout()
-            layout.set_font_description(newdescr)
-            if o.primary:
-                attrs = pango.AttrList()
-                attrs.insert(pango.AttrUnderline(pango.UNDERLINE_SINGLE, end_index=-1))
-                layout.set_attributes(attrs)
-
-            layout.set_text(on)
+            layout, layoutsize = self._text_layout(cr, on, o)
 
             # position text
-            layoutsize = layout.get_pixel_size()
             layoutoffset = -layoutsize[0]/2, -layoutsize[1]/2
             cr.move_to(*center)
             cr.rotate(o.rotation.angle)
             cr.rel_move_to(*layoutoffset)
 
-            # pain text
+            # pain text; the cached layout was created on another context
+            # (or for another target), which has to be taken over first
+            cr.update_layout(layout)
             cr.show_layout(layout)
             cr.restore()
 
+    def _draw_guides(self, xrandr, cr):
+        """Paint the guides the dragged output snapped to"""
+        state = xrandr.state
+
+        for guide in self._guides:
+            cr.save()
+            cr.set_source_rgb(1,0.6,0)
+            if guide.kind == CENTER:
+                cr.set_dash([cr.get_line_width()*4])
+            if guide.orientation == 'vertical':
+                cr.move_to(guide.line, 0)
+                cr.line_to(guide.line, state.virtual.max[1])
+            else:
+                cr.move_to(0, guide.line)
+                cr.line_to(state.virtual.max[0], guide.line)
+            cr.stroke()
+            cr.restore()
+
+    def _text_layout(self, cr, on, o):
+        """Return a pango layout with the output's name and its pixel size.
+
+        Layouts are cached per output, and only recreated when the zoom, or
+        the output's size, rotation or primary flag change, so that a drag
+        does no text layout work."""
+        key = (self.factor, o.size, o.rotation, o.primary)
+        cached = self._layouts.get(on)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+
+        textwidth = o.size[1 if o.rotation.is_odd else 0]
+        widthperchar = textwidth/len(on)
+        textheight = int(widthperchar * 0.8) # i think this looks nice and won't overflow even for wide fonts
+
+        newdescr = pango.FontDescription("sans")
+        newdescr.set_size(textheight * pango.SCALE)
+
+        # create text
+        layout = cr.create_layout()
+        layout.set_font_description(newdescr)
+        if o.primary:
+            attrs = pango.AttrList()
+            attrs.insert(pango.AttrUnderline(pango.UNDERLINE_SINGLE, end_index=-1))
+            layout.set_attributes(attrs)
+
+        layout.set_text(on)
+
+        layoutsize = layout.get_pixel_size()
+        self._layouts[on] = (key, layout, layoutsize)
+        return layout, layoutsize
+
     def _force_repaint(self):
         # using self.allocation as rect is offset by the menu bar.
         self.window.invalidate_rect(gtk.gdk.Rectangle(0,0,self._xrandr.state.virtual.max[0]//self.factor,self._xrandr.state.virtual.max[1]//self.factor), False)
         # this has the side effect of not painting out of the available region on drag and drop
 
+    def _output_extent(self, on, o):
+        """The area (x, y, width, height) an active output is painted on, in
+        virtual screen coordinates, or None for inactive outputs"""
+        if not o.active:
+            return None
+        position = o.tentative_position if hasattr(o, 'tentative_position') else o.position
+        x, y = position
+        w, h = o.size
+        # the name can be larger than the output, and is rotated with it
+        cached = self._layouts.get(on)
+        if cached is not None:
+            t = max(cached[2])
+            if t > w or t > h:
+                cx, cy = x + w/2, y + h/2
+                x, y, w, h = min(x, cx - t/2), min(y, cy - t/2), max(w, t), max(h, t)
+        return (x, y, w, h)
+
+    def _guide_extent(self, guide):
+        vmax = self._xrandr.state.virtual.max
+        if guide.orientation == 'vertical':
+            return (guide.line - 2*self.factor, 0, 4*self.factor, vmax[1])
+        else:
+            return (0, guide.line - 2*self.factor, vmax[0], 4*self.factor)
+
+    def _damage(self, areas):
+        """Repaint the (x, y, width, height) areas of the virtual screen"""
+        if not self.window:
+            return
+        f = self.factor
+        for (x, y, w, h) in areas:
+            # leave room for the outlines, which are 1.5 pixels wide
+            left, top = int(x//f) - 2, int(y//f) - 2
+            right, bottom = int(-(-(x + w)//f)) + 2, int(-(-(y + h)//f)) + 2
+            self.window.invalidate_rect(gtk.gdk.Rectangle(left, top, right - left, bottom - top), False)
+
+    def _damage_begin(self, names):
+        """Remember what is painted for the outputs `names` that are about to
+        change; pass the result to _damage_end after the change to repaint
+        only what changed"""
+        cfg = self._xrandr.configuration
+        return (names, [self._output_extent(on, cfg.outputs[on]) for on in names], self._overlapping, self._guides)
+
+    def _damage_end(self, damage):
+        names, extents, overlapping, guides = damage
+        cfg = self._xrandr.configuration
+        changed = set(names) | (overlapping ^ self._overlapping)
+        areas = extents + [self._output_extent(on, cfg.outputs[on]) for on in changed]
+        areas += [self._guide_extent(g) for g in set(guides) ^ set(self._guides)]
+        self._damage([a for a in areas if a is not None])
+
     #################### click handling ####################
 
+    def _reindex_sequence(self, start=0):
+        """Update the positions in the stacking order (self._zorder) from
+        self.sequence, which changed from index `start` on"""
+        if start == 0:
+            self._zorder = {}
+        for i in range(start, len(self.sequence)):
+            self._zorder[self.sequence[i]] = i
+
     def click(self, widget, event):
         undermouse = self._get_point_outputs(event.x, event.y)
         if event.button == 1 and undermouse:
+            damage = self._damage_begin(undermouse)
             which = self._get_point_active_output(event.x, event.y)
             if self._lastclick == (event.x, event.y): # this was the second click to that stack
                 # push the highest of the undermouse windows below the lowest
-                newpos = min(self.sequence.index(a) for a in undermouse)
-                self.sequence.remove(which)
+                newpos = min(self._zorder[a] for a in undermouse)
+                del self.sequence[self._zorder[which]]
                 self.sequence.insert(newpos,which)
+                self._reindex_sequence(newpos)
                 # sequence changed
                 which = self._get_point_active_output(event.x, event.y)
             # pull the clicked window to the absolute top
-            self.sequence.remove(which)
+            oldpos = self._zorder[which]
+            del self.sequence[oldpos]
             self.sequence.append(which)
+            self._reindex_sequence(oldpos)
 
             self._lastclick = (event.x, event.y)
-            self._force_repaint()
+            self._drop_backing()
+            self._damage_end(damage)
         if event.button == 3:
             if undermouse:
-                target = [a for a in self.sequence if a in undermouse][-1]
+                target = max(undermouse, key=self._zorder.__getitem__)
                 m = self._contextmenu(target)
                 m.popup(None, None, None, event.button, event.time)
             else:
@@ -288,18 +519,13 @@ class ARandRWidget(gtk.DrawingArea):
         self._lastclick = (event.x, event.y) # deposit for drag and drop until better way found to determine exact starting coordinates
 
     def _get_point_outputs(self, x, y):
-        x,y = x*self.factor, y*self.factor
-        outputs = set()
-        for on,o in self._xrandr.configuration.outputs.items():
-            if not o.active: continue
-            if o.position[0]-self.factor <= x <= o.position[0]+o.size[0]+self.factor and o.position[1]-self.factor <= y <= o.position[1]+o.size[1]+self.factor:
-                outputs.add(on)
-        return outputs
+        # the validator keeps the active outputs in a grid
+        return self._validator.grid.at(int(x*self.factor), int(y*self.factor), self.factor)
 
     def _get_point_active_output(self, x, y):
         undermouse = self._get_point_outputs(x, y)
         if not undermouse: raise IndexError("No output here.")
-        active = [a for a in self.sequence if a in undermouse][-1]
+        active = max(undermouse, key=self._zorder.__getitem__)
         return active
 
     #################### context menu ####################
@@ -386,6 +612,11 @@ class ARandRWidget(gtk.DrawingArea):
 
         self._draggingfrom = None
         self._draggingoutput = None
+        self._pendingmotion = None
+        self._motionsource = None
+        # how many motion events were handled, and how many were skipped because a newer one came in first
+        self.motion_events_processed = 0
+        self.motion_events_dropped = 0
         self.connect('drag-begin', self._dragbegin_cb)
         self.connect('drag-motion', self._dragmotion_cb)
         self.connect('drag-drop', self._dragdrop_cb)
@@ -408,7 +639,7 @@ class ARandRWidget(gtk.DrawingArea):
         self._draggingsnap = Snap(
                 self._xrandr.configuration.outputs[self._draggingoutput].size,
                 self.factor*5,
-                [(Position((0,0)),self._xrandr.state.virtual.max)]+[
+                [(Position((0,0)),self._xrandr.state.virtual.max,False)]+[
                     (v.position, v.size) for (k,v) in self._xrandr.configuration.outputs.items() if k!=self._draggingoutput and v.active
                 ]
             )
@@ -421,19 +652,52 @@ class ARandRWidget(gtk.DrawingArea):
 
         context.drag_status(gtk.gdk.ACTION_MOVE, time)
 
+        # only the latest position matters; it is handled once per frame
+        if self._pendingmotion is not None:
+            self.motion_events_dropped += 1
+        self._pendingmotion = (x, y)
+        if self._motionsource is None:
+            self._motionsource = gobject.timeout_add(self.MOTION_INTERVAL, self._process_motion)
+
+        return True
+
+    def _process_motion(self):
+        self._motionsource = None
+        if self._pendingmotion is None or not self._draggingoutput:
+            return False
+        x, y = self._pendingmotion
+        self._pendingmotion = None
+        self.motion_events_processed += 1
+
         rel = x-self._draggingfrom[0], y-self._draggingfrom[1]
 
         oldpos = self._xrandr.configuration.outputs[self._draggingoutput].position
         newpos = Position((oldpos[0]+self.factor*rel[0], oldpos[1]+self.factor*rel[1]))
-        self._xrandr.configuration.outputs[self._draggingoutput].tentative_position = self._draggingsnap.suggest(newpos)
-        self._force_repaint()
-
-        return True
+        damage = self._damage_begin([self._draggingoutput])
+        tentative, self._guides = self._draggingsnap.snap(newpos)
+        self._xrandr.configuration.outputs[self._draggingoutput].tentative_position = tentative
+        self._update_overlapping(self._draggingoutput, tentative)
+        self._damage_end(damage)
+
+        return False # don't call again
+
+    def _cancel_motion(self):
+        if self._motionsource is not None:
+            gobject.source_remove(self._motionsource)
+            self._motionsource = None
+        if self._pendingmotion is not None:
+            self.motion_events_dropped += 1
+            self._pendingmotion = None
 
     def _dragdrop_cb(self, widget, context, x, y, time):
         if not self._draggingoutput:
             return
 
+        # drop where the pointer is, even if the latest motion was not handled yet
+        self._cancel_motion()
+        self._pendingmotion = (x, y)
+        self._process_motion()
+
         try:
             self.set_position(self._draggingoutput, self._xrandr.configuration.outputs[self._draggingoutput].tentative_position)
         except InadequateConfiguration:
@@ -443,10 +707,17 @@ class ARandRWidget(gtk.DrawingArea):
         context.finish(True, False, time)
 
     def _dragend_cb(self, widget, context):
+        self._cancel_motion()
+        damage = self._damage_begin([self._draggingoutput] if self._draggingoutput in self._xrandr.configuration.outputs else [])
         try:
             del self._xrandr.configuration.outputs[self._draggingoutput].tentative_position
         except KeyError:
             pass # already reloaded
+        except AttributeError:
+            pass # ended before the first motion was handled
         self._draggingoutput = None
         self._draggingfrom = None
-        self._force_repaint()
+        self._guides = []
+        self._drop_backing()
+        self._update_overlapping()
+        self._damage_end(damage)
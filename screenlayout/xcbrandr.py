@@ -0,0 +1,366 @@
+# ARandR -- Another XRandR GUI
+# Copyright (C) 2008 -- 2011 chrysn <chrysn@fsfe.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Native RandR backend that talks to the X server via xcb instead of running xrandr
+
+The xrandr backend can use the ChangeListener from here to learn whether it
+has to run `xrandr --verbose` again. Importing this module fails with ImportError
+if python-xcb is not installed; screenlayout.xrandr then always runs xrandr
+to load the state."""
+
+import sys
+
+import xcb
+import xcb.xproto
+import xcb.randr
+
+from .auxiliary import Size, Geometry, NamedSize, NORMAL, LEFT, INVERTED, RIGHT
+
+# from randr.h
+RR_Rotate_0 = 1
+RR_Rotate_90 = 2
+RR_Rotate_180 = 4
+RR_Rotate_270 = 8
+RR_Rotation_Mask = 0xf
+
+RR_Connected = 0
+RR_Disconnected = 1
+RR_UnknownConnection = 2
+
+RRSetConfigSuccess = 0
+
+RRScreenChangeNotifyMask = 1 << 0
+RRCrtcChangeNotifyMask = 1 << 1
+RROutputChangeNotifyMask = 1 << 2
+
+ROTATION_BITS = {
+        NORMAL: RR_Rotate_0,
+        LEFT: RR_Rotate_90,
+        INVERTED: RR_Rotate_180,
+        RIGHT: RR_Rotate_270,
+        }
+BITS_ROTATION = dict((v, k) for (k, v) in ROTATION_BITS.items())
+
+class NativeRandRError(Exception):
+    """The X server could not be reached or does not support RandR 1.2."""
+
+def _string(chars):
+    """Convert a list of CARD8 or characters as returned by xcb into a str"""
+    return ''.join(c if isinstance(c, str) else chr(c) for c in chars)
+
+class ChangeListener(object):
+    """Connection to an X server's RandR extension that tells whether the
+    screen, a CRTC or an output changed"""
+    def __init__(self, display=None):
+        try:
+            if display:
+                self.conn = xcb.connect(display=display)
+            else:
+                self.conn = xcb.connect()
+            self.conn.randr = self.conn(xcb.randr.key)
+
+            self.screen = self.conn.get_setup().roots[self.conn.pref_screen]
+            self.root = self.screen.root
+
+            v = self.conn.randr.QueryVersion(1, 3).reply()
+        except (xcb.Exception, AttributeError, IndexError), e:
+            raise NativeRandRError("Can't use RandR via xcb: %s"%e)
+        self.version = (v.major_version, v.minor_version)
+
+        # see eventdemo.py; the events are only collected in has_changed
+        self.conn.randr.SelectInput(self.root, RRScreenChangeNotifyMask | RRCrtcChangeNotifyMask | RROutputChangeNotifyMask)
+        self.conn.flush()
+
+    def has_changed(self):
+        """Tell whether the server reported a screen, CRTC or output change
+        since the last call (or since the listener was created). If anything
+        goes wrong, everything is considered changed.
+
+        This costs one round trip: as the server processes requests in order,
+        every change that happened before has been reported once the reply
+        arrives."""
+        try:
+            self.conn.core.GetInputFocus().reply()
+
+            changed = False
+            while True:
+                e = self.conn.poll_for_event()
+                if e is None:
+                    break
+                if isinstance(e, (xcb.randr.ScreenChangeNotifyEvent, xcb.randr.NotifyEvent)):
+                    changed = True
+        except Exception:
+            return True
+        return changed
+
+class NativeRandR(ChangeListener):
+    """Connection to an X server's RandR extension that can fill and apply
+    XRandR.State / XRandR.Configuration objects"""
+    def __init__(self, display=None):
+        super(NativeRandR, self).__init__(display)
+
+        # used to keep the DPI when resizing the screen, like xrandr does
+        screen = self.screen
+        self._dpi = (
+                25.4 * screen.width_in_pixels / screen.width_in_millimeters if screen.width_in_millimeters else 96,
+                25.4 * screen.height_in_pixels / screen.height_in_millimeters if screen.height_in_millimeters else 96,
+                )
+
+        self._modeinfo = {} # mode id -> NamedSize
+
+    supports_primary = property(lambda self: self.version >= (1, 3))
+
+    #################### loading ####################
+
+    def _get_resources(self, probe):
+        if probe or not self.supports_primary: # GetScreenResourcesCurrent was introduced in 1.3 too
+            res = self.conn.randr.GetScreenResources(self.root).reply()
+        else:
+            res = self.conn.randr.GetScreenResourcesCurrent(self.root).reply()
+
+        names = _string(res.names)
+        self._modeinfo = {}
+        offset = 0
+        for m in res.modes:
+            self._modeinfo[m.id] = NamedSize(Size((m.width, m.height)), name=names[offset:offset+m.name_len])
+            offset += m.name_len
+
+        return res
+
+    def load(self, state, configuration):
+        """Fill the freshly created XRandR.State `state` and
+        XRandR.Configuration `configuration` with what the server reports,
+        probing the outputs like `xrandr --verbose` would."""
+        res = self._get_resources(probe=True)
+        ts = res.config_timestamp
+
+        sizerange = self.conn.randr.GetScreenSizeRange(self.root).reply()
+        geometry = self.conn.core.GetGeometry(self.root).reply()
+        state.virtual = state.Virtual(
+                min = Size((sizerange.min_width, sizerange.min_height)),
+                max = Size((sizerange.max_width, sizerange.max_height)),
+                )
+        configuration.virtual = Size((geometry.width, geometry.height))
+
+        primary_id = None
+        if self.supports_primary:
+            primary_id = self.conn.randr.GetOutputPrimary(self.root).reply().output
+
+        # send all requests before waiting for the first reply
+        infos = [(oid, self.conn.randr.GetOutputInfo(oid, ts)) for oid in res.outputs]
+        infos = [(oid, cookie.reply()) for (oid, cookie) in infos]
+        crtcids = set(info.crtc for (oid, info) in infos if info.crtc)
+        crtcids.update(info.crtcs[0] for (oid, info) in infos if not info.crtc and info.crtcs)
+        crtcs = dict((cid, self.conn.randr.GetCrtcInfo(cid, ts)) for cid in crtcids)
+        crtcs = dict((cid, cookie.reply()) for (cid, cookie) in crtcs.items())
+
+        for oid, info in infos:
+            o = state.Output(_string(info.name))
+            o.connected = info.connection in (RR_Connected, RR_UnknownConnection)
+
+            crtc = crtcs.get(info.crtc) if info.crtc else None
+            if crtc is not None and crtc.mode:
+                active = True
+                rotation = BITS_ROTATION.get(crtc.rotation & RR_Rotation_Mask, NORMAL)
+                mode = self._modeinfo.get(crtc.mode)
+                if mode is not None:
+                    # the crtc's own size includes --scale and other
+                    # transformations, which the configuration can't express
+                    size = (mode[1], mode[0]) if rotation.is_odd else tuple(mode)
+                    geometry = Geometry(size[0], size[1], crtc.x, crtc.y)
+                    currentname = mode.name
+                else:
+                    geometry = Geometry(crtc.width, crtc.height, crtc.x, crtc.y)
+                    currentname = None
+            else:
+                active = False
+                geometry = None
+                rotation = None
+                currentname = None
+
+            # xrandr shows the rotations of the first crtc for outputs that don't have one
+            rotcrtc = crtc if crtc is not None else (crtcs.get(info.crtcs[0]) if info.crtcs else None)
+            o.rotations = set()
+            if rotcrtc is not None:
+                o.rotations.update(r for (r, bit) in ROTATION_BITS.items() if rotcrtc.rotations & bit)
+
+            for mid in info.modes:
+                o.add_mode(self._modeinfo[mid])
+
+            primary = self.supports_primary and oid == primary_id
+
+            state.outputs[o.name] = o
+            configuration.outputs[o.name] = configuration.OutputConfiguration(active, primary, geometry, rotation, currentname)
+
+    #################### saving ####################
+
+    def _screen_mm(self, size):
+        return [int(round(25.4 * px / dpi)) for (px, dpi) in zip(size, self._dpi)]
+
+    def _set_crtc(self, crtcid, ts, x, y, mode, rotation, outputs):
+        reply = self.conn.randr.SetCrtcConfig(crtcid, 0, ts, x, y, mode, rotation, len(outputs), outputs).reply()
+        if reply.status != RRSetConfigSuccess:
+            raise Exception("RandR refused to configure CRTC 0x%x (status %d)."%(crtcid, reply.status))
+
+    def apply(self, xrandr, fb):
+        """Apply xrandr.configuration using SetCrtcConfig, with a screen of
+        size `fb` (see XRandR.check_configuration). CRTCs that are switched off or
+        would not fit the new screen size are disabled first, then the screen
+        is resized (at most once), then CRTCs that cover a smaller area are
+        set, then those that grow, and finally those that get enabled. If
+        one of those steps fails, the CRTCs and the screen size are set back
+        as they were, like xrandr does."""
+        cfg = xrandr.configuration
+        res = self._get_resources(probe=False)
+        ts = res.config_timestamp
+
+        screensize = self.conn.core.GetGeometry(self.root)
+        infos = [(oid, self.conn.randr.GetOutputInfo(oid, ts)) for oid in res.outputs]
+        infos = dict((_string(info.name), (oid, info)) for (oid, info) in ((oid, cookie.reply()) for (oid, cookie) in infos))
+        crtcs = dict((cid, self.conn.randr.GetCrtcInfo(cid, ts)) for cid in res.crtcs)
+        crtcs = dict((cid, cookie.reply()) for (cid, cookie) in crtcs.items())
+        screensize = screensize.reply()
+
+        # assign crtcs: keep current ones (also for outputs that share one as
+        # clones, as long as they stay alike), give free ones to outputs
+        # that are switched on or no longer alike their clones
+        def alike(a, b):
+            return a.position == b.position and a.rotation == b.rotation and a.mode.name == b.mode.name and tuple(a.mode) == tuple(b.mode)
+        def stays(on):
+            # outputs that stay where their crtc is come first to keep it
+            crtc = infos[on][1].crtc
+            oc = cfg.outputs[on]
+            return not (crtc and oc.active and (crtcs[crtc].x, crtcs[crtc].y) == tuple(oc.position)), on
+        assigned = {} # crtc id -> [output name, ...]
+        unassigned = []
+        for on in sorted(cfg.outputs, key=stays):
+            oc = cfg.outputs[on]
+            oid, info = infos[on]
+            if not oc.active:
+                continue
+            if info.crtc:
+                clones = assigned.setdefault(info.crtc, [])
+                if not clones or alike(cfg.outputs[clones[0]], oc):
+                    clones.append(on)
+                    continue
+            unassigned.append(on)
+        for on in unassigned:
+            oid, info = infos[on]
+            free = [c for c in info.crtcs if c not in assigned]
+            idle = [c for c in free if not crtcs[c].outputs]
+            if not free:
+                raise Exception("No CRTC left for output %s."%on)
+            assigned[(idle or free)[0]] = [on]
+
+        wanted = {} # crtc id -> (x, y, mode id, rotation bits, [output id, ...])
+        for cid, names in assigned.items():
+            oc = cfg.outputs[names[0]]
+            oids = []
+            usable = None # ids of modes all the clones have under that name and size
+            for on in names:
+                oid, info = infos[on]
+                matching = [m for m in info.modes if self._modeinfo[m].name == oc.mode.name and tuple(self._modeinfo[m]) == tuple(oc.mode)]
+                if not matching:
+                    raise Exception("Mode %s not available for output %s."%(oc.mode.name, on))
+                usable = matching if usable is None else [m for m in usable if m in matching]
+                oids.append(oid)
+            if not usable:
+                raise Exception("Outputs %s can't be cloned with different modes."%", ".join(names))
+            # modes that only differ in their refresh rate share a name; keep
+            # the one the crtc runs if it is among them
+            mid = crtcs[cid].mode if crtcs[cid].mode in usable else usable[0]
+            reflection = crtcs[cid].rotation & ~RR_Rotation_Mask
+            wanted[cid] = (oc.position[0], oc.position[1], mid, ROTATION_BITS[oc.rotation] | reflection, sorted(oids))
+
+        current = dict((cid, (crtc.x, crtc.y, crtc.mode, crtc.rotation, sorted(crtc.outputs))) for (cid, crtc) in crtcs.items() if crtc.mode)
+        saved = dict(current)
+
+        # crtcs that stay as they are keep their transformation (eg. --scale),
+        # so their actual size has to fit the screen
+        fb = list(fb)
+        for cid in wanted:
+            if current.get(cid) == wanted[cid]:
+                fb[0] = max(fb[0], crtcs[cid].x + crtcs[cid].width)
+                fb[1] = max(fb[1], crtcs[cid].y + crtcs[cid].height)
+
+        touched = [] # crtcs that were set, so they can be restored if something fails
+        resized = False
+        self.conn.core.GrabServer()
+        try:
+            for cid, crtc in crtcs.items():
+                if cid not in current:
+                    continue
+                outside = crtc.x + crtc.width > fb[0] or crtc.y + crtc.height > fb[1]
+                if cid not in wanted or (outside and wanted[cid] != current[cid]):
+                    touched.append(cid)
+                    self._set_crtc(cid, ts, 0, 0, 0, RR_Rotate_0, [])
+                    del current[cid]
+
+            if (screensize.width, screensize.height) != tuple(fb):
+                mm = self._screen_mm(fb)
+                resized = True
+                self.conn.randr.SetScreenSizeChecked(self.root, fb[0], fb[1], mm[0], mm[1]).check()
+
+            def area(modeid):
+                m = self._modeinfo.get(modeid)
+                return m[0] * m[1] if m is not None else 0
+            def step(cid):
+                if cid not in current:
+                    return 2 # enable
+                if area(wanted[cid][2]) < area(current[cid][2]):
+                    return 0 # shrink
+                return 1 # grow
+            for cid in sorted(wanted, key=lambda cid: (step(cid), cid)):
+                if current.get(cid) == wanted[cid]:
+                    continue
+                touched.append(cid)
+                self._set_crtc(cid, ts, *wanted[cid])
+
+            if self.supports_primary:
+                primary = [infos[on][0] for (on, oc) in cfg.outputs.items() if oc.active and oc.primary]
+                primary = primary[0] if primary else 0 # like xrandr --noprimary
+                if primary != self.conn.randr.GetOutputPrimary(self.root).reply().output:
+                    self.conn.randr.SetOutputPrimary(self.root, primary)
+        except Exception:
+            error = sys.exc_info()
+            self._restore(ts, saved, touched, (screensize.width, screensize.height) if resized else None)
+            raise error[0], error[1], error[2]
+        finally:
+            self.conn.core.UngrabServer()
+            self.conn.flush()
+
+    def _restore(self, ts, saved, touched, screensize):
+        """Undo a failed apply like xrandr does: switch the `touched` crtcs
+        off, give the screen its old size back if it was resized, and set
+        those crtcs as they were (`saved` has their configuration, if they
+        were on). Failures while doing that are ignored."""
+        for cid in touched:
+            try:
+                self._set_crtc(cid, ts, 0, 0, 0, RR_Rotate_0, [])
+            except Exception:
+                pass
+        if screensize is not None:
+            try:
+                mm = self._screen_mm(screensize)
+                self.conn.randr.SetScreenSizeChecked(self.root, screensize[0], screensize[1], mm[0], mm[1]).check()
+            except Exception:
+                pass
+        for cid in touched:
+            if cid in saved:
+                try:
+                    self._set_crtc(cid, ts, *saved[cid])
+                except Exception:
+                    pass
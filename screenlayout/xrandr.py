@@ -17,61 +17,530 @@
 """Wrapper around command line xrandr (mostly 1.2 per output features supported)"""
 
 import os
+import re
+import sys
+import json
+import time
+import errno
+import fcntl
+import bisect
+import select
+import signal
+import tempfile
+import threading
 import subprocess
 import warnings
 
-from .auxiliary import BetterList, Size, Position, Geometry, FileLoadError, FileSyntaxError, InadequateConfiguration, Rotation, ROTATIONS, NORMAL, NamedSize
+from .auxiliary import BetterList, Size, Position, Geometry, FileLoadError, FileSyntaxError, InadequateConfiguration, XRandRTimeout, CallCancelled, Rotation, ROTATIONS, NORMAL, NamedSize
+
+try:
+    from . import xcbrandr
+except ImportError:
+    xcbrandr = None
 
 import gettext
 gettext.install('arandr')
 
 SHELLSHEBANG='#!/bin/sh'
 
+# serialises writes to record files, which may be shared by several XRandR
+# objects and threads (eg. in arandr-fleet)
+_record_lock = threading.Lock()
+
 class Feature(object):
     PRIMARY = 1
 
+# `xrandr --version` output by "<display>\n<xrandr path>\n<xrandr mtime>", see XRandR._get_version_output
+_version_cache = {}
+
+class _Steps(object):
+    """Driver for the generators that implement XRandR's operations. Those
+    yield tuples of arguments to xrandr (and get its output sent back), other
+    such generators (which are run to completion right there), or a list that
+    is the operation's result.
+
+    This way, XRandR's blocking methods and PendingCall share all the code
+    that does not run xrandr. Like with `yield from`, exceptions of a nested
+    generator are raised in the one that yielded it."""
+    def __init__(self, steps):
+        self._stack = [steps]
+        self.result = None
+
+    def send(self, output):
+        """Return the next tuple of arguments xrandr has to be run with, or
+        raise StopIteration when the operation is complete."""
+        error = None # exc_info of a nested generator that failed
+        while self._stack:
+            try:
+                if error is not None:
+                    step = self._stack[-1].throw(*error)
+                    error = None
+                else:
+                    step = self._stack[-1].send(output)
+            except StopIteration:
+                self._stack.pop()
+                output = None
+                error = None
+                continue
+            except Exception:
+                self._stack.pop()
+                if not self._stack:
+                    raise
+                error = sys.exc_info()
+                continue
+            output = None
+            if isinstance(step, tuple):
+                return step
+            elif isinstance(step, list):
+                self.result = step
+            else:
+                self._stack.append(step)
+        raise StopIteration
+
+    def close(self):
+        while self._stack:
+            self._stack.pop().close()
+
+class _XRandRProcess(object):
+    """xrandr running in a process group of its own, so that it can be killed
+    together with anything it started. Its output is read without blocking;
+    stderr goes to a temporary file so there is only one pipe to watch."""
+    def __init__(self, args, environ):
+        self.args = args
+        self.started = time.time()
+        self.duration = None
+        self.status = None # None if it was killed
+        self.err = None
+        self._chunks = []
+        self._stderr = tempfile.TemporaryFile()
+        self._popen = subprocess.Popen(("xrandr",)+args, stdout=subprocess.PIPE, stderr=self._stderr, env=environ, preexec_fn=os.setsid)
+        fd = self._popen.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def fileno(self):
+        return self._popen.stdout.fileno()
+
+    def read(self):
+        """Read what xrandr wrote so far, and tell whether it is done writing"""
+        try:
+            data = os.read(self.fileno(), 65536)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+        self._chunks.append(data)
+        return not data
+
+    def finish(self):
+        """Wait for xrandr to exit after read() returned True, and return its
+        output (see XRandR._check_status for failures)"""
+        self.status = self._popen.wait()
+        self.duration = time.time() - self.started
+        self._popen.stdout.close()
+        self._stderr.seek(0)
+        self.err = self._stderr.read()
+        self._stderr.close()
+        XRandR._check_status(self.status, self.err)
+        return self.output
+
+    output = property(lambda self: "".join(self._chunks))
+
+    def kill(self):
+        try:
+            os.killpg(self._popen.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self._popen.wait()
+        self.duration = time.time() - self.started
+        self._popen.stdout.close()
+        self._stderr.close()
+
+class _Replay(object):
+    """Calls to xrandr as recorded by an XRandR object (see XRandR.__init__),
+    which are handed out in the order they were recorded"""
+    def __init__(self, filename):
+        self.filename = filename
+        self._calls = []
+        for line in open(filename):
+            call = json.loads(line)
+            call['args'] = [a.encode('utf-8') for a in call['args']]
+            for k in ('stdout', 'stderr'):
+                if call.get(k) is not None:
+                    call[k] = call[k].encode('utf-8')
+            self._calls.append(call)
+        self._calls.reverse()
+
+    def output(self, args):
+        """Return what xrandr printed for `args`, or raise what running it raised"""
+        if not self._calls:
+            raise Exception("xrandr %s was run, but %s has no further calls."%(" ".join(args), self.filename))
+        call = self._calls.pop()
+        if call['args'] != list(args):
+            raise Exception("xrandr %s was run, but %s has xrandr %s next."%(" ".join(args), self.filename, " ".join(call['args'])))
+        if call.get('killed'):
+            raise XRandRTimeout("xrandr %s did not finish in time (replayed)."%" ".join(args))
+        XRandR._check_status(call['status'], call['stderr'])
+        return call['stdout']
+
+def _earliest(*times):
+    """The earliest of the given points in time that are not None"""
+    times = [t for t in times if t is not None]
+    return min(times) if times else None
+
+class PendingCall(object):
+    """An XRandR operation that runs xrandr without blocking, as started by
+    XRandR.start_load_from_x, .start_load_from_string and .start_save_to_x.
+
+    To integrate with an event loop, wait for fileno() to become readable and
+    call process() then (the file descriptor can change during process(), as
+    some operations run xrandr more than once). Once `done` is True, result()
+    returns what the corresponding blocking method would have returned, or
+    raises what it would have raised. wait() blocks until then.
+
+    If a `timeout` is given, the call fails with XRandRTimeout when it is not
+    done that many seconds after it was started; this is checked in process()
+    and wait(). Unlike the blocking methods, pending calls are not retried:
+    their timeout limits the whole operation. cancel() stops the call, making
+    result() raise CallCancelled.
+
+    The XRandR object must not be used otherwise while a call is pending.
+    The xcb backend does not need to run xrandr; its operations are complete
+    as soon as they are started."""
+    def __init__(self, xrandr, steps, timeout=None):
+        self._xrandr = xrandr
+        self._steps = _Steps(steps)
+        self.deadline = _earliest(None if timeout is None else time.time() + timeout, xrandr.deadline)
+        self.done = False
+        self._result = None
+        self._error = None
+        self._process = None
+
+        self._advance(None)
+
+    def fileno(self):
+        return self._process.fileno() if self._process is not None else None
+
+    def _advance(self, output):
+        try:
+            args = self._steps.send(output)
+        except StopIteration:
+            self._finish(result=self._steps.result)
+        except Exception, e:
+            self._finish(error=e)
+        else:
+            if self._xrandr._replay is not None:
+                try:
+                    output = self._xrandr._replay.output(args)
+                except Exception, e:
+                    self._steps.close()
+                    self._finish(error=e)
+                else:
+                    self._advance(output)
+                return
+            self._process = _XRandRProcess(args, self._xrandr.environ)
+
+    def _finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self.done = True
+
+    def _stop_process(self):
+        if self._process is not None:
+            self._process.kill()
+            self._xrandr._record_call(self._process)
+            self._process = None
+
+    def process(self):
+        """Read what xrandr wrote, and go on with the operation once it is
+        finished. Does not block."""
+        if self.done:
+            return
+
+        if self.deadline is not None and time.time() >= self.deadline:
+            self._stop_process()
+            self._steps.close()
+            self._finish(error=XRandRTimeout("XRandR did not finish in time."))
+            return
+
+        if not self._process.read():
+            return
+
+        process = self._process
+        self._process = None
+        try:
+            try:
+                output = process.finish()
+            finally:
+                self._xrandr._record_call(process)
+        except Exception, e:
+            self._steps.close()
+            self._finish(error=e)
+        else:
+            self._advance(output)
+
+    def wait(self):
+        """Block until the call is done, and return its result."""
+        while not self.done:
+            timeout = None if self.deadline is None else max(0, self.deadline - time.time())
+            select.select([self.fileno()], [], [], timeout)
+            self.process()
+        return self.result()
+
+    def cancel(self):
+        if self.done:
+            return
+        self._stop_process()
+        self._steps.close()
+        self._finish(error=CallCancelled("The call to XRandR was cancelled."))
+
+    def result(self):
+        assert self.done, "The call is still pending."
+        if self._error is not None:
+            raise self._error
+        return self._result
+
 class XRandR(object):
     DEFAULTTEMPLATE = [SHELLSHEBANG, '%(xrandr)s']
-
-    def __init__(self, display=None, force_version=False):
+    # if set to a file name, the results of `xrandr --version` are also
+    # cached there across processes (eg. for scripts run from hotkeys)
+    VERSION_CACHE_FILE = os.environ.get('ARANDR_VERSION_CACHE') or None
+    # read-only invocations of xrandr (--version, --verbose) that time out are
+    # retried that often, waiting RETRY_DELAY seconds before the first retry
+    # and twice as long before each further one
+    RETRIES = 2
+    RETRY_DELAY = 0.5
+
+    def __init__(self, display=None, force_version=False, backend=None, timeout=None, record=None, replay=None, retries=None, deadline=None, events=False):
         """Create proxy object and check for xrandr at `display`. Fail with
-        untested versions unless `force_version` is True."""
+        untested versions unless `force_version` is True.
+
+        `backend` can be 'xrandr' (the default) to run the xrandr binary, or
+        'xcb' to talk to the RandR extension directly, which needs
+        python-xcb. The 'offline' backend does not talk to any
+        X server; such objects get their state from snapshots (see
+        screenlayout.snapshot) and can't be applied.
+
+        If a `timeout` is given, xrandr is killed when it runs longer than
+        that many seconds, and XRandRTimeout is raised. Read-only calls are
+        retried `retries` times before (by default, RETRIES); interactive
+        users should rather get the error early. The start_* methods use the
+        timeout for the whole operation unless they are given one.
+
+        A `deadline` (a time.time() value) limits everything the object does
+        with xrandr, including the retries and the version check done here.
+        Neither timeouts nor deadlines apply to the xcb backend.
+
+        With `record`, every call to xrandr (arguments, output, error output,
+        exit status and duration) is appended to the file of that name as a
+        line of JSON; several objects can record into the same file. With
+        `replay`, xrandr is not run at all; instead, the calls recorded in
+        that file are answered in order (failing if the calls differ from the
+        recording). Both need the xrandr backend, and default to the
+        ARANDR_RECORD and ARANDR_REPLAY environment variables when it is
+        used.
+
+        With `events`, the xrandr backend listens for RandR's change events
+        if python-xcb is available, so that load_from_string and
+        save_to_x(only_changes=True) only run `xrandr --verbose` again when
+        X reports a change (the xcb backend always does that; load_from_x
+        always probes the outputs). This is not done when recording or
+        replaying, or with a deadline; the round trip it costs is not limited
+        by timeouts. The `events` attribute tells whether changes are
+        known this way."""
+        self.timeout = timeout
+        self.retries = self.RETRIES if retries is None else retries
+        self.deadline = deadline
         self.environ = dict(os.environ)
         if display:
             self.environ['DISPLAY'] = display
 
-        version_output = self._output("--version")
-        supported_versions = ["1.2", "1.3", "1.4", "1.5"]
-        if not any(x in version_output for x in supported_versions) and not force_version:
-            raise Exception("XRandR %s required."%"/".join(supported_versions))
+        if backend not in (None, 'xcb', 'xrandr', 'offline'):
+            raise ValueError("Unknown backend: %r"%backend)
+
+        if (record or replay) and backend not in (None, 'xrandr'):
+            raise ValueError("Recording and replaying need the xrandr backend.")
+        if backend in (None, 'xrandr'):
+            # other backends don't run xrandr, so there is nothing to record
+            record = record or os.environ.get('ARANDR_RECORD') or None
+            replay = replay or os.environ.get('ARANDR_REPLAY') or None
+        self._record = record
+        self._replay = _Replay(replay) if replay else None
+
+        self._native = None
+        self._changes = None # tells whether X changed since the last load, if known
+        if backend == 'xcb':
+            if xcbrandr is None:
+                raise Exception("The xcb backend requires python-xcb.")
+            self._native = self._changes = xcbrandr.NativeRandR(display)
+        elif backend != 'offline' and events and xcbrandr is not None and not (record or replay) and deadline is None:
+            try:
+                self._changes = xcbrandr.ChangeListener(display)
+            except Exception:
+                pass # then xrandr is run for every load
+        self.backend = backend or 'xrandr'
+        self.events = self._changes is not None
+
+        self._loaded = None # (state, configuration) as last loaded from X, kept unmodified
 
         self.features = set()
-        if not " 1.2" in version_output:
+        if self._native is not None:
+            if self._native.version < (1, 2) and not force_version:
+                raise Exception("RandR 1.2 required, server supports %d.%d."%self._native.version)
+
+            if self._native.supports_primary:
+                self.features.add(Feature.PRIMARY)
+        elif self.backend == 'offline':
             self.features.add(Feature.PRIMARY)
+        else:
+            version_output = self._get_version_output()
+            supported_versions = ["1.2", "1.3", "1.4", "1.5"]
+            if not any(x in version_output for x in supported_versions) and not force_version:
+                raise Exception("XRandR %s required."%"/".join(supported_versions))
+
+            if not " 1.2" in version_output:
+                self.features.add(Feature.PRIMARY)
 
     def _get_outputs(self):
-        assert self.state.outputs.keys() == self.configuration.outputs.keys()
+        # (comparing the lists would depend on how the dictionaries were built)
+        assert self.state.outputs.viewkeys() == self.configuration.outputs.viewkeys()
         return self.state.outputs.keys()
     outputs = property(_get_outputs)
 
     #################### calling xrandr ####################
 
     def _output(self, *args):
-        p = subprocess.Popen(("xrandr",)+args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.environ)
-        ret, err = p.communicate()
-        status = p.wait()
+        retries = self.retries if args in (("--version",), ("--verbose",)) else 0
+        delay = self.RETRY_DELAY
+        while True:
+            try:
+                return self._output_once(args)
+            except XRandRTimeout:
+                if not retries or (self.deadline is not None and time.time() + delay >= self.deadline):
+                    raise
+                retries -= 1
+                if self._replay is None: # replays run as fast as they can
+                    time.sleep(delay)
+                delay *= 2
+
+    def _output_once(self, args):
+        if self._replay is not None:
+            return self._replay.output(args)
+
+        p = _XRandRProcess(args, self.environ)
+        deadline = _earliest(None if self.timeout is None else time.time() + self.timeout, self.deadline)
+        while not p.read():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                p.kill()
+                self._record_call(p)
+                raise XRandRTimeout("xrandr %s did not finish in time (after %.1f seconds)."%(" ".join(args), time.time() - p.started))
+            select.select([p], [], [], remaining)
+        try:
+            return p.finish()
+        finally:
+            self._record_call(p)
+
+    def _record_call(self, process):
+        if self._record is None:
+            return
+        if process.status is None:
+            call = {'args': process.args, 'killed': True, 'duration': process.duration}
+        else:
+            call = {'args': process.args, 'stdout': process.output, 'stderr': process.err, 'status': process.status, 'duration': process.duration}
+        line = json.dumps(call) + "\n"
+        with _record_lock:
+            f = open(self._record, 'a')
+            try:
+                f.write(line)
+            finally:
+                f.close()
+
+    @staticmethod
+    def _check_status(status, err):
         if status!=0:
             raise Exception("XRandR returned error code %d: %s"%(status,err))
         if err:
             warnings.warn("XRandR wrote to stderr, but did not report an error (Message was: %r)"%err)
-        return ret
 
     def _run(self, *args):
         self._output(*args)
 
+    def _call(self, steps):
+        """Run an operation's generator (see _Steps), blocking for xrandr"""
+        steps = _Steps(steps)
+        output = None
+        try:
+            while True:
+                try:
+                    args = steps.send(output)
+                except StopIteration:
+                    return steps.result
+                output = self._output(*args)
+        finally:
+            # if xrandr failed, the generators clean up right away
+            steps.close()
+
+    def _get_version_output(self):
+        """Run `xrandr --version` unless it has already been run for this
+        display and this very xrandr binary (identified by its path and
+        modification time, so upgrades are noticed)."""
+        if self._record is not None or self._replay is not None:
+            # recordings have to be independent of the cache's state
+            return self._output("--version")
+
+        for directory in self.environ.get('PATH', os.defpath).split(os.pathsep):
+            binary = os.path.join(directory, 'xrandr')
+            if os.access(binary, os.X_OK):
+                break
+        else:
+            return self._output("--version") # let that fail the usual way
+
+        key = "%s\n%s\n%r"%(self.environ.get('DISPLAY', ''), binary, os.stat(binary).st_mtime)
+
+        if key not in _version_cache and self.VERSION_CACHE_FILE:
+            try:
+                _version_cache.update(json.load(open(self.VERSION_CACHE_FILE)))
+            except (IOError, ValueError):
+                pass
+
+        if key not in _version_cache:
+            _version_cache[key] = self._output("--version")
+
+            if self.VERSION_CACHE_FILE:
+                # write to a temporary file first so concurrent readers never see half a file
+                try:
+                    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.VERSION_CACHE_FILE)))
+                    with os.fdopen(fd, 'w') as f:
+                        json.dump(_version_cache, f)
+                    os.rename(tmpname, self.VERSION_CACHE_FILE)
+                except (IOError, OSError), e:
+                    warnings.warn("Could not write xrandr version cache: %s"%e)
+
+        return _version_cache[key]
+
     #################### loading ####################
 
-    def load_from_string(self, data):
+    def load_from_string(self, data, reuse=False):
+        """Load the layout from the shell script `data` on top of the state
+        of X, and return the script as a template (see
+        save_to_shellscript_string).
+
+        With `reuse`, what was last loaded from X is used again, so that
+        loading a batch of layout files probes X only once (or again if a
+        file names outputs or modes that were not there back then). Without
+        it, the xrandr backend loads the state again, as other clients may
+        have changed it, unless change events tell that they did not (see
+        __init__).
+
+        If loading fails, the state and configuration are left as they
+        were, like with load_from_x."""
+        return self._call(self._load_from_string(data, reuse))
+
+    def start_load_from_string(self, data, timeout=None, reuse=False):
+        """Like load_from_string, but return a PendingCall instead of blocking"""
+        return PendingCall(self, self._load_from_string(data, reuse), self.timeout if timeout is None else timeout)
+
+    def _load_from_string(self, data, reuse=False):
         data = data.replace("%","%%")
         lines = data.split("\n")
         if lines[-1] == '': lines.pop() # don't create empty last line
@@ -84,20 +553,41 @@ class XRandR(object):
             raise FileLoadError('No recognized xrandr command in this shell script.')
         if len(xrandrlines)>1:
             raise FileLoadError('More than one xrandr line in this shell script.')
-        self._load_from_commandlineargs(lines[xrandrlines[0]].strip())
+        loaded = self._loaded
+        reuse = reuse or self.events
+        # if the file can't be loaded (or X does not answer in time), the
+        # state and configuration from before are kept
+        before = (self.state, self.configuration) if hasattr(self, 'state') else None
+        done = False
+        try:
+            yield self._load_from_x(reuse=reuse)
+            try:
+                self._load_from_commandlineargs(lines[xrandrlines[0]].strip())
+            except FileSyntaxError:
+                raise
+            except FileLoadError:
+                if self.backend != 'xrandr' or loaded is None or self._loaded is not loaded:
+                    raise
+                # the reused state predates outputs or modes the file names
+                yield self._load_from_x()
+                self._load_from_commandlineargs(lines[xrandrlines[0]].strip())
+            done = True
+        finally:
+            if not done and before is not None:
+                self.state, self.configuration = before
         lines[xrandrlines[0]] = '%(xrandr)s'
 
-        return lines
+        yield lines
 
     def _load_from_commandlineargs(self, commandline):
-        self.load_from_x()
-
         args = BetterList(commandline.split(" "))
         if args.pop(0) != 'xrandr':
             raise FileSyntaxError()
         options = dict((a[0], a[1:]) for a in args.split('--output') if a) # first part is empty, exclude empty parts
 
         for on,oa in options.items():
+            if on not in self.state.outputs:
+                raise FileLoadError("Not a known output: %s"%on)
             o = self.configuration.outputs[on]
             os = self.state.outputs[on]
             o.primary = False
@@ -113,11 +603,9 @@ class XRandR(object):
                 parts = [(oa[2*i],oa[2*i+1]) for i in range(len(oa)//2)]
                 for p in parts:
                     if p[0] == '--mode':
-                        for namedmode in os.modes:
-                            if namedmode.name == p[1]:
-                                o.mode = namedmode
-                                break
-                        else:
+                        try:
+                            o.mode = os.get_mode(p[1])
+                        except KeyError:
                             raise FileLoadError("Not a known mode: %s"%p[1])
                     elif p[0] == '--pos':
                         o.position = Position(p[1])
@@ -129,109 +617,142 @@ class XRandR(object):
                         raise FileSyntaxError()
                 o.active = True
 
-    def load_from_x(self): # FIXME -- use a library
-        self.configuration = self.Configuration(self)
-        self.state = self.State()
-
-        screenline, items = self._load_raw_lines()
+    def load_from_x(self):
+        """Load the state and configuration from X (if that fails or times
+        out, the ones from before are kept)"""
+        self._call(self._load_from_x())
+
+    def start_load_from_x(self, timeout=None):
+        """Like load_from_x, but return a PendingCall instead of blocking"""
+        return PendingCall(self, self._load_from_x(), self.timeout if timeout is None else timeout)
+
+    def _load_from_x(self, reuse=False):
+        """With `reuse`, what was last loaded from X is used again if there is
+        no indication that it changed since (which is only known for sure
+        with change events, see __init__)."""
+        if self.backend == 'offline':
+            if self._loaded is None:
+                raise Exception("Offline XRandR objects need to be loaded from a snapshot first.")
+            reuse = True
+
+        if self._changes is not None and self._changes.has_changed():
+            # outdated now; forgotten already in case loading fails
+            self._loaded = None
+        elif self._loaded is not None and reuse:
+            self.state = self._loaded[0]
+            self.configuration = self._loaded[1].copy()
+            return
+
+        # until everything is loaded, the old state and configuration stay
+        # in place, so that a failing or timed out load does not lose them
+        state = self.State()
+        configuration = self.Configuration(self)
+
+        if self._native is not None:
+            self._native.load(state, configuration)
+        else:
+            self._load_from_verbose((yield ("--verbose",)), state, configuration)
+
+        self.state = state
+        self.configuration = configuration
+        self._loaded = (state, configuration.copy())
+
+    # A single scan over `xrandr --verbose` output yields one token per line
+    # that is of interest: the screen line, output headlines, and modes (a
+    # mode line together with its h: and v: lines, which give the size).
+    # Every token starts at a newline (one is put in front of the output for
+    # the first line), which the regular expression engine searches for
+    # without trying the pattern at other positions; tab-indented property
+    # lines fail right after it.
+    _VERBOSE_TOKENS = re.compile(r"""\n(?:
+            (?P<screen>Screen\ [^\n]*)
+          | (?P<headline>[^\s][^\n]*)
+          | \ \ (?P<mode>\S+)\ \(0x[0-9a-f]+\)(?P<flags>[^\n]*)\n
+            \ +h:\ width\ +(?P<width>\d+)[^\n]*\n
+            \ +v:\ height\ +(?P<height>\d+)
+        )""", re.VERBOSE)
+
+    def _load_from_verbose(self, output, state, configuration):
+        """Fill the fresh `state` and `configuration` from `xrandr --verbose` output"""
+        screenline = None
+        o = None # output whose modes are currently being read
+        known_modes = {} # (name, width, height) as strings -> NamedSize; like in the xcb backend, outputs share their mode objects
+
+        for screen, headline, n, flags, w, h in self._VERBOSE_TOKENS.findall("\n" + output):
+            if n:
+                key = (n, w, h)
+                mode = known_modes.get(key)
+                if mode is None:
+                    mode = known_modes[key] = NamedSize((int(w), int(h)), n)
+                if "*current" in flags:
+                    currentname = n
+                append(mode)
+            elif headline:
+                if o is not None:
+                    o.add_modes(modes)
+                    configuration.outputs[o.name] = configuration.OutputConfiguration(active, primary, geometry, rotation, currentname)
+
+                o, active, primary, geometry, rotation = self._load_parse_headline(headline, state)
+                modes = []
+                append = modes.append
+                currentname = None
+                state.outputs[o.name] = o
+            elif screen:
+                assert screenline is None
+                screenline = screen
 
-        self._load_parse_screenline(screenline)
+        if o is not None:
+            o.add_modes(modes)
+            configuration.outputs[o.name] = configuration.OutputConfiguration(active, primary, geometry, rotation, currentname)
 
-        for headline,details in items:
-            if headline.startswith("  "): continue # a currently disconnected part of the screen i can't currently get any info out of
-            if headline == "": continue # noise
+        self._load_parse_screenline(screenline, state, configuration)
 
-            headline = headline.replace('unknown connection', 'unknown-connection')
-            hsplit = headline.split(" ")
-            o = self.state.Output(hsplit[0])
-            assert hsplit[1] in ("connected","disconnected", 'unknown-connection')
+    def _load_parse_headline(self, headline, state):
+        headline = headline.replace('unknown connection', 'unknown-connection')
+        hsplit = headline.split(" ")
+        o = state.Output(hsplit[0])
+        assert hsplit[1] in ("connected","disconnected", 'unknown-connection')
 
-            o.connected = (hsplit[1] in ('connected', 'unknown-connection'))
+        o.connected = (hsplit[1] in ('connected', 'unknown-connection'))
 
-            primary = False
-            if 'primary' in hsplit:
-                if Feature.PRIMARY in self.features:
-                    primary = True
-                hsplit.remove('primary')
+        primary = False
+        if 'primary' in hsplit:
+            if Feature.PRIMARY in self.features:
+                primary = True
+            hsplit.remove('primary')
 
-            if not hsplit[2].startswith("("):
-                active = True
+        if not hsplit[2].startswith("("):
+            active = True
 
-                geometry = Geometry(hsplit[2])
+            geometry = Geometry(hsplit[2])
 
-                modeid = hsplit[3].strip("()")
+            if hsplit[4] in ROTATIONS: rotation = Rotation(hsplit[4])
+            else: rotation = NORMAL
+        else:
+            active = False
+            geometry = None
+            rotation = None
 
-                if hsplit[4] in ROTATIONS: rotation = Rotation(hsplit[4])
-                else: rotation = NORMAL
-            else:
-                active = False
-                geometry = None
-                modeid = None
-                rotation = None
-
-            o.rotations = set()
-            for r in ROTATIONS:
-                if r in headline:
-                    o.rotations.add(r)
-
-            currentname = None
-            for d, w, h in details:
-                n, m = d[0:2]
-                k = m.strip("()")
-                try:
-                    r = Size([int(w), int(h)])
-                except ValueError:
-                    raise Exception("Output %s parse error: modename %s modeid %s."%(o.name, n,k))
-                if "*current" in d:
-                    currentname = n
-                for x in [ "+preferred", "*current" ]:
-                    if x in d: d.remove(x)
-
-                for old_mode in o.modes:
-                    if old_mode.name == n:
-                        if tuple(old_mode) != tuple(r):
-                            warnings.warn("Supressing duplicate mode %s even though it has different resolutions (%s, %s)."%(n, r, old_mode))
-                        break
-                else:
-                    # the mode is really new
-                    o.modes.append(NamedSize(r, name=n))
+        o.rotations = set()
+        for r in ROTATIONS:
+            if r in headline:
+                o.rotations.add(r)
 
-            self.state.outputs[o.name] = o
-            self.configuration.outputs[o.name] = self.configuration.OutputConfiguration(active, primary, geometry, rotation, currentname)
+        return o, active, primary, geometry, rotation
 
-    def _load_raw_lines(self):
-        output = self._output("--verbose")
-        items = []
-        screenline = None
-        for l in output.split('\n'):
-            if l.startswith("Screen "):
-                assert screenline is None
-                screenline = l
-            elif l.startswith('\t'):
-                continue
-            elif l.startswith(2*' '): # [mode, width, height]
-                l = l.strip()
-                if reduce(bool.__or__, [l.startswith(x+':') for x in "hv"]):
-                    l = l[-len(l):l.index(" start")-len(l)]
-                    items[-1][1][-1].append(l[l.rindex(' '):])
-                else: # mode
-                    items[-1][1].append([l.split()])
-            else:
-                items.append([l, []])
-        return screenline, items
+    _SCREENLINE = re.compile(r"Screen \d+: minimum (\d+) x (\d+), current (\d+) x (\d+), maximum (\d+) x (\d+)$")
 
-    def _load_parse_screenline(self, screenline):
+    def _load_parse_screenline(self, screenline, state, configuration):
         assert screenline is not None
-        ssplit = screenline.split(" ")
+        match = self._SCREENLINE.match(screenline)
+        assert match is not None
+        minw, minh, w, h, maxw, maxh = [int(x) for x in match.groups()]
 
-        ssplit_expect = ["Screen",None,"minimum",None,"x",None,"current",None,"x",None,"maximum",None,"x",None]
-        assert all(a==b for (a,b) in zip(ssplit,ssplit_expect) if b is not None)
-
-        self.state.virtual = self.state.Virtual(
-                min = Size((int(ssplit[3]),int(ssplit[5][:-1]))),
-                max = Size((int(ssplit[11]),int(ssplit[13])))
+        state.virtual = state.Virtual(
+                min = Size((minw, minh)),
+                max = Size((maxw, maxh))
                 )
-        self.configuration.virtual = Size((int(ssplit[7]),int(ssplit[9][:-1])))
+        configuration.virtual = Size((w, h))
 
     #################### saving ####################
 
@@ -249,12 +770,82 @@ class XRandR(object):
 
         return template%d
 
-    def save_to_x(self):
-        self.check_configuration()
-        self._run(*self.configuration.commandlineargs())
+    def get_changes(self):
+        """Tell what differs from what was last loaded from X, as a
+        dictionary from output names to lists of changed properties (see
+        Configuration.diff). With the xrandr backend, save_to_x(only_changes=True)
+        loads the state again first, as other clients may have changed it
+        (which does not run xrandr if change events tell that there were none,
+        see __init__).
+
+        This needs the state from X, which is dropped when a configuration
+        is applied, as X may have adjusted it; load_from_x has to be called
+        again after save_to_x."""
+        if self._loaded is None:
+            raise Exception("Nothing to compare with: load_from_x has to be called first (again after save_to_x).")
+        return self.configuration.diff(self._loaded[1])
+
+    def save_to_x(self, only_changes=False):
+        """Apply the configuration, resizing the framebuffer at most once
+        (the xcb backend to the size check_configuration returns, xrandr on
+        its own). With `only_changes`, xrandr is only told about outputs and
+        options that differ from what X has right before applying (which is
+        loaded again for that). (The xcb backend always only touches CRTCs
+        that need changing.)"""
+        self._call(self._save_to_x(only_changes))
+
+    def start_save_to_x(self, only_changes=False, timeout=None):
+        """Like save_to_x, but return a PendingCall instead of blocking"""
+        return PendingCall(self, self._save_to_x(only_changes), self.timeout if timeout is None else timeout)
+
+    def _save_to_x(self, only_changes):
+        if self.backend == 'offline':
+            raise Exception("Offline XRandR objects can't be applied.")
+        if only_changes and self._native is None:
+            # what was loaded can be outdated by other clients; the changes
+            # have to be relative to what X has right now (if X reports
+            # changes as events, this only runs xrandr if there were any)
+            yield self._reload_for_apply()
+        if self._native is not None:
+            self._native.apply(self, self.check_configuration())
+        else:
+            # xrandr orders the steps and resizes the screen once by itself,
+            # taking panning and transformations into account, which the
+            # configuration does not know about
+            self.check_configuration()
+            changes = self.get_changes() if only_changes and self._loaded is not None else None
+            if changes != {}:
+                yield tuple(self.configuration.commandlineargs(changes))
+        self._loaded = None
+
+    def _reload_for_apply(self):
+        """Load the state from X again, keeping the configuration that is to
+        be applied (outputs that are new to it are taken over as they are).
+        If outputs of the configuration are gone, InadequateConfiguration is
+        raised and the previous state is kept."""
+        state, configuration = self.state, self.configuration
+        done = False
+        try:
+            yield self._load_from_x(reuse=self.events)
+            gone = sorted(on for on in configuration.outputs if on not in self.state.outputs)
+            if gone:
+                raise InadequateConfiguration(_("Output %s is no longer there; the state has to be loaded from X again.")%", ".join(gone))
+            for on, o in self.configuration.outputs.items():
+                configuration.outputs.setdefault(on, o)
+            done = True
+        finally:
+            if done:
+                self.configuration = configuration
+            else:
+                self.state, self.configuration = state, configuration
+                self._loaded = None
 
     def check_configuration(self):
+        """Raise InadequateConfiguration if the configuration can't be
+        applied, and return the size the framebuffer needs to have for it."""
         vmax = self.state.virtual.max
+        vmin = self.state.virtual.min
+        fb = [vmin[0], vmin[1]]
 
         for on in self.outputs:
             oc = self.configuration.outputs[on]
@@ -278,10 +869,17 @@ class XRandR(object):
             if oc.position[0] < 0 or oc.position[1] < 0:
                 raise InadequateConfiguration(_("An output is outside the virtual screen."))
 
+            fb[0] = max(fb[0], x)
+            fb[1] = max(fb[1], y)
+
+        return Size(fb)
+
     #################### sub objects ####################
 
     class State(object):
-        """Represents everything that can not be set by xrandr."""
+        """Represents everything that can not be set by xrandr.
+
+        State objects are not modified after loading, and may be shared between loads."""
         def __init__(self):
             self.outputs = {}
 
@@ -296,7 +894,57 @@ class XRandR(object):
         class Output(object):
             def __init__(self, name):
                 self.name = name
-                self.modes = []
+                self.modes = [] # in the order reported by xrandr; use add_mode to extend
+                self._modes_by_name = {}
+                # the following are only created when needed
+                self._modes_by_size = None
+                self._modes_by_area = None # ([-area], [mode]), sorted by descending area
+
+            def add_mode(self, mode):
+                """Append a NamedSize unless a mode of the same name is
+                already known (then, the first one is kept, with a warning if
+                it differs in size)."""
+                self.add_modes((mode,))
+
+            def add_modes(self, modes):
+                """Like add_mode for each of `modes`, in order"""
+                modes_by_name = self._modes_by_name
+                for mode in modes:
+                    old_mode = modes_by_name.get(mode.name)
+                    if old_mode is None:
+                        self.modes.append(mode)
+                        modes_by_name[mode.name] = mode
+                    elif old_mode is not mode and tuple(old_mode) != tuple(mode):
+                        warnings.warn("Supressing duplicate mode %s even though it has different resolutions (%s, %s)."%(mode.name, mode, old_mode))
+                self._modes_by_size = self._modes_by_area = None
+
+            def get_mode(self, name):
+                """Return the mode called `name`, or raise KeyError"""
+                return self._modes_by_name[name]
+
+            def get_mode_by_size(self, size):
+                """Return the first mode of a given (width, height), or raise KeyError"""
+                if self._modes_by_size is None:
+                    self._modes_by_size = {}
+                    for m in reversed(self.modes):
+                        self._modes_by_size[tuple(m)] = m
+                return self._modes_by_size[tuple(size)]
+
+            def get_largest_mode(self, maxsize):
+                """Return the mode with the largest area that fits into
+                maxsize, preferring earlier modes of equal area, or None if
+                none fits."""
+                if self._modes_by_area is None:
+                    order = sorted(range(len(self.modes)), key=lambda i: (-self.modes[i][0]*self.modes[i][1], i))
+                    self._modes_by_area = ([-self.modes[i][0]*self.modes[i][1] for i in order], [self.modes[i] for i in order])
+                keys, modes = self._modes_by_area
+
+                # modes larger in area than maxsize can't fit; of the others,
+                # the first that fits in both dimensions is the largest
+                for m in modes[bisect.bisect_left(keys, -maxsize[0]*maxsize[1]):]:
+                    if m[0] <= maxsize[0] and m[1] <= maxsize[1]:
+                        return m
+                return None
 
             def __repr__(self):
                 return '<%s %r (%d modes)>'%(type(self).__name__, self.name, len(self.modes))
@@ -310,34 +958,118 @@ class XRandR(object):
         def __repr__(self):
             return '<%s for %d Outputs, %d active>'%(type(self).__name__, len(self.outputs), len([x for x in self.outputs.values() if x.active]))
 
-        def commandlineargs(self):
+        def copy(self):
+            """Return a copy whose outputs can be modified independently"""
+            c = type(self)(self._xrandr)
+            c.virtual = self.virtual
+            c.outputs = dict((on, o.copy()) for (on, o) in self.outputs.items())
+            return c
+
+        def diff(self, other):
+            """Return a dictionary from the names of outputs configured
+            differently than in `other` to lists of what differs; those can
+            contain 'active', 'primary', 'mode', 'position' and 'rotation'.
+            Outputs that get switched on list everything that needs to be
+            set."""
+            changes = {}
+            for on, o in self.outputs.items():
+                old = other.outputs.get(on)
+                if not o.active:
+                    if old is None or old.active:
+                        changes[on] = ['active']
+                    continue
+                if old is None or not old.active:
+                    changes[on] = ['active', 'primary', 'mode', 'position', 'rotation']
+                    continue
+
+                changed = []
+                if o.primary != old.primary:
+                    changed.append('primary')
+                if o.mode.name != old.mode.name or tuple(o.mode) != tuple(old.mode):
+                    changed.append('mode')
+                if tuple(o.position) != tuple(old.position):
+                    changed.append('position')
+                if o.rotation != old.rotation:
+                    changed.append('rotation')
+                if changed:
+                    changes[on] = changed
+            return changes
+
+        def commandlineargs(self, changes=None):
+            """Return the xrandr arguments for this configuration; if
+            `changes` (as returned by diff) is given, only for what is listed
+            there."""
             args = []
+            noprimary = False
             for on,o in self.outputs.items():
+                if changes is None:
+                    changed = ('active', 'primary', 'mode', 'position', 'rotation')
+                elif on in changes:
+                    changed = changes[on]
+                else:
+                    continue
+
+                if o.active and 'primary' in changed and not o.primary:
+                    noprimary = True
+                    if len(changed) == 1:
+                        continue
+
                 args.append("--output")
                 args.append(on)
                 if not o.active:
                     args.append("--off")
                 else:
                     if Feature.PRIMARY in self._xrandr.features:
-                        if o.primary:
+                        if o.primary and 'primary' in changed:
                             args.append("--primary")
-                    args.append("--mode")
-                    args.append(str(o.mode.name))
-                    args.append("--pos")
-                    args.append(str(o.position))
-                    args.append("--rotate")
-                    args.append(o.rotation)
+                    if 'mode' in changed:
+                        args.append("--mode")
+                        args.append(str(o.mode.name))
+                    if 'position' in changed:
+                        args.append("--pos")
+                        args.append(str(o.position))
+                    if 'rotation' in changed:
+                        args.append("--rotate")
+                        args.append(o.rotation)
+
+            # an output lost its primary flag without another one getting it
+            if changes is not None and noprimary and Feature.PRIMARY in self._xrandr.features and not any(o.active and o.primary for o in self.outputs.values()):
+                args.append("--noprimary")
             return args
 
         class OutputConfiguration(object):
+            # position, rotation and mode are only set on active outputs;
+            # tentative_position is set by the widget while dragging
+            __slots__ = ('active', 'primary', 'position', 'rotation', 'mode', 'tentative_position', '_size')
+
             def __init__(self, active, primary, geometry, rotation, modename):
                 self.active = active
                 self.primary = primary
+                self._size = None # (mode, rotation, size) of the last size calculation
                 if active:
                     self.position = geometry.position
                     self.rotation = rotation
                     if rotation.is_odd:
-                        self.mode = NamedSize(Size(reversed(geometry.size)), name=modename)
+                        self.mode = NamedSize(reversed(geometry.size), name=modename)
                     else:
                         self.mode = NamedSize(geometry.size, name=modename)
-            size = property(lambda self: NamedSize(Size(reversed(self.mode)), name=self.mode.name) if self.rotation.is_odd else self.mode)
+
+            def copy(self):
+                c = object.__new__(type(self))
+                for attribute in self.__slots__:
+                    try:
+                        setattr(c, attribute, getattr(self, attribute))
+                    except AttributeError:
+                        pass # not set on inactive outputs
+                return c
+
+            def _get_size(self):
+                """The mode's size, turned if the output is rotated"""
+                mode = self.mode
+                if not self.rotation.is_odd:
+                    return mode
+                cached = self._size
+                if cached is None or cached[0] is not mode or cached[1] is not self.rotation:
+                    cached = self._size = (mode, self.rotation, NamedSize((mode[1], mode[0]), name=mode.name))
+                return cached[2]
+            size = property(_get_size)
@@ -103,6 +103,7 @@ class build_man(NoOptionCommand):
         for (sourcefile, gzfile) in [
                 ('data/arandr.1.txt', os.path.join('build', 'arandr.1.gz')),
                 ('data/unxrandr.1.txt', os.path.join('build', 'unxrandr.1.gz')),
+                ('data/arandr-fleet.1.txt', os.path.join('build', 'arandr-fleet.1.gz')),
                 ]:
 
             if newer(sourcefile, gzfile):
@@ -253,7 +254,7 @@ setup(name = PACKAGENAME,
             },
         data_files = [
             ('share/applications', ['data/arandr.desktop']), # FIXME: use desktop-file-install?
-            ('share/man/man1', ['build/arandr.1.gz', 'build/unxrandr.1.gz']),
+            ('share/man/man1', ['build/arandr.1.gz', 'build/unxrandr.1.gz', 'build/arandr-fleet.1.gz']),
             ],
-        scripts = ['arandr', 'unxrandr'],
+        scripts = ['arandr', 'unxrandr', 'arandr-fleet'],
 )